@@ -0,0 +1,182 @@
+import os
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils import *
+
+SUMMARY_NAME = "summary"
+ROLLUP_NAME = "rollup_"
+# Run attributes the flows of every run are rolled up by
+ROLLUP_DIMENSIONS = ('alg', 'link_config', 'num_host_pairs')
+# Run directories handed to a worker at a time
+AGGREGATE_CHUNK_SIZE = 8
+
+# Log spaced histogram bins CWND (segments) and RTT (ms) samples are counted
+# into. Histograms of different runs add up, so distributions over many runs
+# are found without loading their samples together. Percentiles read from
+# them are the upper edge of the bin they fall in, within 5% of the sample
+CWND_BINS = np.concatenate(([0], np.geomspace(1, 1e7, 331)))
+RTT_BINS = np.concatenate(([0], np.geomspace(1e-3, 1e5, 379)))
+
+# Returns the directories below results_dir holding a run's manifest, sorted
+def findRuns(results_dir):
+  runs = []
+  for dir_path, dir_names, file_names in os.walk(results_dir):
+    if MANIFEST_NAME in file_names:
+      runs.append(os.path.join(dir_path, ''))
+      # a run's own directories hold no further runs
+      dir_names.clear()
+
+  return sorted(runs)
+
+# Returns the value at percentile q (0-100) of the samples counted in hist, a
+# histogram over bins, NaN if hist is empty
+def histPercentile(hist, bins, q):
+  total = hist.sum()
+  if total == 0:
+    return np.nan
+
+  return bins[1:][np.searchsorted(np.cumsum(hist), total * q / 100)]
+
+# Summarizes every flow of the run saved in run_dir from its exported results.
+# Returns (rows, cwnd_hists, rtt_hists), a summary dict per flow and the
+# flow's CWND and RTT histograms over CWND_BINS and RTT_BINS. Runs that can not
+# be read are reported and give no rows
+def summarizeRun(run_dir):
+  rows, cwnd_hists, rtt_hists = [], [], []
+  try:
+    manifest = loadManifest(run_dir)
+    for flow in manifest['flows']:
+      frames = {name: dfLoad(os.path.join(run_dir, path)) for name, path in flow.get('files', {}).items()}
+      cwnd = frames['ftrace']['CWND'].to_numpy(dtype=np.float64) if 'ftrace' in frames else np.array([])
+      rtt = frames['rtt']['RTT'].to_numpy(dtype=np.float64) if 'rtt' in frames else np.array([])
+      rtt = rtt[~np.isnan(rtt)]
+      # runs exported before lost pings were recorded only have the replies
+      lost = frames['rtt'].get('Lost') if 'rtt' in frames else None
+
+      # iperf3's own reports are preferred to goodput found from the capture
+      throughput, retransmits = np.nan, np.nan
+      if 'iperf' in frames:
+        throughput = frames['iperf']['Throughput'].mean()
+        retransmits = frames['iperf']['Retransmits'].sum()
+      elif 'pcap' in frames:
+        throughput = frames['pcap']['Goodput'].mean()
+        retransmits = frames['pcap']['Retransmits'].sum()
+
+      rows.append({
+        'run': os.path.basename(os.path.normpath(run_dir)),
+        'description': manifest.get('description'),
+        'link_config': manifest.get('link_config_name'),
+        'num_host_pairs': manifest.get('num_host_pairs', len(manifest['flows'])),
+        'runtime': manifest.get('runtime'),
+        'flow': f"{flow['client']}-{flow['server']}",
+        'alg': flow.get('alg') or 'default',
+        'delay': flow.get('delay'),
+        'throughput': throughput,
+        'retransmits': retransmits,
+        'cwnd_mean': cwnd.mean() if len(cwnd) > 0 else np.nan,
+        'rtt_mean': rtt.mean() if len(rtt) > 0 else np.nan,
+        'rtt_p50': np.percentile(rtt, 50) if len(rtt) > 0 else np.nan,
+        'rtt_p95': np.percentile(rtt, 95) if len(rtt) > 0 else np.nan,
+        'rtt_p99': np.percentile(rtt, 99) if len(rtt) > 0 else np.nan,
+        'ping_loss': lost.mean() if lost is not None else np.nan
+      })
+      cwnd_hists.append(np.histogram(cwnd, CWND_BINS)[0])
+      rtt_hists.append(np.histogram(rtt, RTT_BINS)[0])
+  except (OSError, ValueError, KeyError) as e:
+    print(f"Skipping run {run_dir}: {e!r}")
+    return [], [], []
+
+  return rows, cwnd_hists, rtt_hists
+
+# Rolls summary, a dataframe of flow summaries, up by column, with
+# distributions taken from the flows' histograms cwnd_hists and rtt_hists.
+# Returns a dataframe with a row per value of column
+def rollUp(summary, cwnd_hists, rtt_hists, column):
+  rows = []
+  for value, group in summary.groupby(column, sort=True):
+    cwnd_hist = cwnd_hists[group.index].sum(axis=0)
+    rtt_hist = rtt_hists[group.index].sum(axis=0)
+    rows.append({
+      column: value,
+      'runs': group['run'].nunique(),
+      'flows': len(group),
+      'throughput_mean': group['throughput'].mean(),
+      'throughput_std': group['throughput'].std(),
+      'retransmits_mean': group['retransmits'].mean(),
+      'cwnd_p5': histPercentile(cwnd_hist, CWND_BINS, 5),
+      'cwnd_p50': histPercentile(cwnd_hist, CWND_BINS, 50),
+      'cwnd_p95': histPercentile(cwnd_hist, CWND_BINS, 95),
+      'rtt_p50': histPercentile(rtt_hist, RTT_BINS, 50),
+      'rtt_p95': histPercentile(rtt_hist, RTT_BINS, 95),
+      'rtt_p99': histPercentile(rtt_hist, RTT_BINS, 99),
+      'ping_loss_mean': group['ping_loss'].mean()
+    })
+
+  return pd.DataFrame(rows)
+
+# Summarizes every run found below results_dir in a pool of workers processes
+# and writes a summary with a row per flow, and a rollup per ROLLUP_DIMENSIONS
+# entry, to results_dir in export format export_format.
+# Returns the paths of the written files
+def aggregateRuns(results_dir=DEFAULT_OUTPUT_DIR, workers=None, export_format='csv'):
+  runs = findRuns(results_dir)
+  print(f"Aggregating {len(runs)} runs found in {results_dir}")
+
+  if workers is None:
+    workers = os.cpu_count() or 1
+  workers = max(1, min(workers, len(runs)))
+
+  if workers <= 1:
+    results = [summarizeRun(run_dir) for run_dir in runs]
+  else:
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+      results = list(pool.map(summarizeRun, runs, chunksize=AGGREGATE_CHUNK_SIZE))
+
+  summary = pd.DataFrame([row for rows, _, _ in results for row in rows])
+  cwnd_hists = np.array([hist for _, hists, _ in results for hist in hists]).reshape(-1, len(CWND_BINS) - 1)
+  rtt_hists = np.array([hist for _, _, hists in results for hist in hists]).reshape(-1, len(RTT_BINS) - 1)
+
+  results_dir = os.path.join(results_dir, '')
+  paths = [dfExport(summary, results_dir + SUMMARY_NAME, export_format)]
+  if len(summary) > 0:
+    for column in ROLLUP_DIMENSIONS:
+      rollup = rollUp(summary, cwnd_hists, rtt_hists, column)
+      paths.append(dfExport(rollup, results_dir + ROLLUP_NAME + column, export_format))
+
+  return paths
+
+if __name__ == '__main__':
+  usage = "Usage: aggregate.py [results directory] [-w workers] [-f format]"
+  results_dir = DEFAULT_OUTPUT_DIR
+  workers = None
+  export_format = 'csv'
+
+  args = sys.argv[1:]
+  i = 0
+  while i < len(args):
+    if args[i] == '-f' and i + 1 < len(args):
+      i += 1
+      if not exportFormatAvailable(args[i]):
+        sys.exit(f"'{args[i]}' is not an available export format")
+      export_format = args[i]
+    elif args[i] == '-w' and i + 1 < len(args):
+      i += 1
+      if not args[i].isdigit() or int(args[i]) <= 0:
+        sys.exit(f"'{args[i]}' is not a valid number of workers")
+      workers = int(args[i])
+    elif not args[i].startswith('-'):
+      results_dir = args[i]
+    else:
+      sys.exit(f"'{args[i]}' is not a valid option. {usage}")
+    i += 1
+
+  if not os.path.isdir(results_dir):
+    sys.exit(f"'{results_dir}' is not a directory. {usage}")
+
+  for path in aggregateRuns(results_dir, workers, export_format):
+    print(f"Saved {path}")
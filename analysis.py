@@ -0,0 +1,523 @@
+import os
+import sys
+import re
+import json
+import glob
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# render figures to files only, so post-processing never needs a display and
+# never blocks waiting for a window to close
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+import numpy as np
+import pandas as pd
+
+from utils import *
+
+# Directory in a run's output directory that parsed dataframes are cached in
+CACHE_DIR_NAME = ".cache/"
+# Bytes hashed per read when computing a file's digest
+DIGEST_READ_SIZE = 1024 * 1024
+# Part of every cache key, raised when parsers change what they return so
+# results cached by earlier versions are parsed again
+CACHE_VERSION = 2
+# iperf3 ports and addresses runs from before the manifest was written used
+LEGACY_C_PORT = '5201'
+LEGACY_S_PORT = '5001'
+MININET_IP_PREFIX = "10.0.0."
+
+# Format parsed dataframes are cached in. Feather files are memory mapped when
+# loaded, so cached frames load almost instantly
+def cacheFormat():
+  return 'feather' if exportFormatAvailable('feather') else 'npz'
+
+# Returns the blake2b digest of the contents of the file at path as a hex
+# string. Digests are remembered in cache_dir along with the size and
+# modification time of the file they were computed from, so an unchanged file
+# is only read once
+def fileDigest(path, cache_dir):
+  stat = os.stat(path)
+  stamp = [stat.st_size, stat.st_mtime_ns]
+  stamp_path = os.path.join(cache_dir, "digests", hashlib.blake2b(os.path.abspath(path).encode(), digest_size=16).hexdigest() + ".json")
+
+  try:
+    with open(stamp_path, 'r') as stamp_file:
+      saved = json.load(stamp_file)
+    if saved['stamp'] == stamp:
+      return saved['digest']
+  except (OSError, ValueError, KeyError):
+    pass
+
+  digest = hashlib.blake2b()
+  with open(path, 'rb') as raw_file:
+    for block in iter(lambda: raw_file.read(DIGEST_READ_SIZE), b""):
+      digest.update(block)
+  digest = digest.hexdigest()
+
+  checkDir(os.path.dirname(stamp_path))
+  with open(stamp_path, 'w') as stamp_file:
+    json.dump({'stamp': stamp, 'digest': digest}, stamp_file)
+
+  return digest
+
+# Calls parse(source, *args), a utils parser of the raw file, directory or list
+# of files source, caching its result in cache_dir. Results are keyed by the content of
+# the source files, the parser and args, so a changed file is parsed again
+# while an unchanged one is loaded from the cache. Parsers returning a
+# dataframe or a dict of dataframes keyed by tuples of strings are supported.
+# If cache_dir is None the result is not cached
+def cachedParse(cache_dir, parse, source, *args):
+  if cache_dir is None:
+    return parse(source, *args)
+
+  paths = []
+  for path in source if isinstance(source, list) else [source]:
+    # a directory, such as a raw ftrace capture, is keyed by every file in it
+    if os.path.isdir(path):
+      paths += [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    else:
+      # a compressed file is keyed by its compressed contents
+      paths.append(artifactPath(path))
+  key = hashlib.blake2b(digest_size=20)
+  key.update(f"{CACHE_VERSION}:{parse.__name__}".encode())
+  for path in paths:
+    key.update(fileDigest(path, cache_dir).encode())
+  key.update(repr(args).encode())
+  entry_dir = os.path.join(cache_dir, key.hexdigest())
+
+  index_path = os.path.join(entry_dir, "frames.json")
+  if os.path.exists(index_path):
+    with open(index_path, 'r') as index_file:
+      index = json.load(index_file)
+    frames = {tuple(frame_key) if frame_key is not None else None: dfLoad(os.path.join(entry_dir, name)) for frame_key, name in index}
+    return frames[None] if None in frames else frames
+
+  result = parse(source, *args)
+  frames = {None: result} if isinstance(result, pd.DataFrame) else result
+
+  # build the entry beside its final location and move it into place, so
+  # parallel workers never see a partly written entry
+  checkDir(cache_dir)
+  build_dir = tempfile.mkdtemp(dir=cache_dir)
+  index = []
+  for i, (frame_key, df) in enumerate(frames.items()):
+    path = dfExport(df, os.path.join(build_dir, str(i)), cacheFormat())
+    index.append([frame_key, os.path.basename(path)])
+  with open(os.path.join(build_dir, "frames.json"), 'w') as index_file:
+    json.dump(index, index_file)
+
+  try:
+    os.rename(build_dir, entry_dir)
+  except OSError:
+    # another worker cached the same result first
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+  return result
+
+# Reduces the series y over sorted x to at most four points per bucket of
+# buckets equal width buckets spanning x: the first, minimum, maximum and last
+# point of the bucket, each at its own x and in the order they were sampled.
+# Drawn as a line at one bucket per pixel this looks the same as the full
+# series, so drawing time depends on the width of the figure rather than on
+# the number of points. NaN values are skipped, and kept only where a whole
+# bucket is NaN, leaving the same gap in the line.
+# Returns the reduced x and y as numpy arrays
+def decimate(x, y, buckets):
+  x = np.asarray(x, dtype=np.float64)
+  y = np.asarray(y, dtype=np.float64)
+  if len(x) <= 4 * buckets:
+    return x, y
+
+  span = x[-1] - x[0]
+  idx = np.zeros(len(x), dtype=np.int64)
+  if span > 0:
+    idx = ((x - x[0]) / span * buckets).astype(np.int64)
+  # runs of samples in the same bucket. Out of order samples only start a new
+  # run, which draws more points but still the same line
+  starts = np.concatenate(([0], np.flatnonzero(np.diff(idx)) + 1))
+  ends = np.concatenate((starts[1:], [len(x)])) - 1
+  run = np.repeat(np.arange(len(starts)), ends - starts + 1)
+  positions = np.arange(len(x))
+
+  # first and last non NaN sample of each run, its first and last sample if
+  # the whole run is NaN
+  valid = ~np.isnan(y)
+  firsts = np.minimum.reduceat(np.where(valid, positions, len(x)), starts)
+  firsts = np.where(firsts < len(x), firsts, starts)
+  lasts = np.maximum.reduceat(np.where(valid, positions, -1), starts)
+  lasts = np.where(lasts >= 0, lasts, ends)
+
+  # first sample of each run equal to its minimum and maximum
+  def firstEqual(values):
+    found = np.minimum.reduceat(np.where(y == values[run], positions, len(x)), starts)
+    return np.where(found < len(x), found, starts)
+
+  with np.errstate(invalid='ignore'):
+    mins = firstEqual(np.fmin.reduceat(y, starts))
+    maxs = firstEqual(np.fmax.reduceat(y, starts))
+
+  points = np.stack((firsts, np.minimum(mins, maxs), np.maximum(mins, maxs), lasts), axis=1).ravel()
+  return x[points], y[points]
+
+# Plots column of df against its "Time" column on ax, decimated to the width
+# of fig in pixels. See decimate
+def plotDecimated(fig, ax, df, column):
+  ax.plot(*decimate(df['Time'], df[column], int(fig.get_figwidth() * fig.dpi)))
+
+# Plots the rtt and ftrace dataframes of a flow as a new figure titled title,
+# saves it as a .png at path, then closes the figure to free its memory. If
+# the flow's iperf3 dataframe is given its throughput is plotted below. Series
+# are decimated before plotting, the dataframes themselves are left untouched
+def plotFlow(rtt, ftrace, title, path, iperf=None):
+  if iperf is None:
+    fig, (ax1, ax2) = plt.subplots(2)
+  else:
+    fig, (ax1, ax2, ax3) = plt.subplots(3, figsize=(6.4, 7.2))
+
+  plotDecimated(fig, ax1, rtt, 'RTT')
+  ax1.set_title("RTT")
+  ax1.set_xlabel("Time (s)")
+  ax1.set_ylabel("Round-Trip Time (ms)")
+
+  plotDecimated(fig, ax2, ftrace, 'CWND')
+  ax2.set_title("CWND")
+  ax2.set_xlabel("Time (s)")
+  ax2.set_ylabel("Window Size (segments)")
+
+  if iperf is not None:
+    plotDecimated(fig, ax3, iperf, 'Throughput')
+    ax3.set_title("Throughput")
+    ax3.set_xlabel("Time (s)")
+    ax3.set_ylabel("Throughput (Mbit/s)")
+
+  fig.suptitle(title)
+  fig.tight_layout()
+  fig.savefig(path)
+  plt.close(fig)
+
+# Parses, exports and plots the results of a single flow of the run saved in
+# output_dir.
+#
+# flow: dict describing the flow, as returned by HostPair.describe
+# ftrace: the flow's dataframe from utils.parseFtraceFlows
+# export_format: key of utils.EXPORT_FORMATS to export dataframes in
+# time_origin, clock_offset: clock the run was timed with, see utils.getRTTs.
+#                            If time_origin is None, ftrace was parsed with
+#                            times relative to the flow's first entry
+# pcap: the flow's dataframe from utils.parsePcapFlows, if it was captured
+# cache_dir: directory parsed dataframes are cached in, see cachedParse
+# cprofile_path: if given, the flow's analysis is profiled with cProfile and
+#                the statistics saved to it
+# count_written: if True, the bytes written of each phase are counted, see
+#                utils.RunProfiler
+#
+# Returns a dict of the exported file paths, relative to output_dir, and the
+# phases of the flow's analysis as recorded by utils.RunProfiler
+def analyzeFlow(output_dir, flow, ftrace, export_format, time_origin=None, clock_offset=0.0, pcap=None, cache_dir=None, cprofile_path=None, count_written=False):
+  flow_dir = output_dir + flow['result_dir']
+  profiler = RunProfiler(flow_dir, cprofile_path is not None, count_written)
+  profiler.startCProfile()
+
+  # seconds from the run's start instant to when the flow actually started.
+  # Runs from before this was recorded only have the nominal delay
+  start_offset = flow.get('start_offset', flow['delay'])
+
+  if time_origin is None:
+    # shift the flow's times by when it was started
+    ftrace = ftrace.copy()
+    ftrace['Time'] = ftrace['Time'] + start_offset
+  profiler.start('rtt_parse')
+  rtt = cachedParse(cache_dir, getRTTs, flow_dir + "ping.txt", time_origin, clock_offset)
+
+  # iperf3 interval times are relative to the start of the flow
+  iperf = None
+  if flow.get('iperf_log', '').endswith('.json'):
+    profiler.start('iperf_parse')
+    iperf = cachedParse(cache_dir, parseIperfJSON, flow_dir + flow['iperf_log'], start_offset)
+
+  profiler.start('export')
+  files = {
+    'rtt': os.path.relpath(dfExport(rtt, flow_dir + "ping", export_format), output_dir),
+    'ftrace': os.path.relpath(dfExport(ftrace, flow_dir + "ftrace", export_format), output_dir)
+  }
+
+  if pcap is not None:
+    files['pcap'] = os.path.relpath(dfExport(pcap, flow_dir + "pcap", export_format), output_dir)
+
+  if iperf is not None:
+    files['iperf'] = os.path.relpath(dfExport(iperf, flow_dir + "iperf", export_format), output_dir)
+
+  profiler.start('plot')
+  plotFlow(rtt, ftrace, f"CWND and RTT for {flow['client']}-{flow['server']} flow", flow_dir + "graph.png", iperf)
+  profiler.stop()
+  profiler.saveCProfile(cprofile_path)
+
+  return files, profiler.phases
+
+# Parses, exports and plots the results of every flow of the run saved in
+# output_dir, spreading the flows over a pool of workers processes.
+#
+# flows: list of dicts describing each flow, as returned by HostPair.describe
+# ftrace_flows: per flow dataframes returned by utils.parseFtraceFlows
+# export_format: key of utils.EXPORT_FORMATS to export dataframes in
+# workers: number of worker processes, defaults to the number of cpus. With 1
+#          worker flows are analyzed one after another in this process
+# time_origin, clock_offset: see analyzeFlow
+# pcap_flows: per flow dataframes returned by utils.parsePcapFlows, None if
+#             packets were not captured
+# cache_dir: see analyzeFlow
+# profiler: utils.RunProfiler of the run, if given each flow's analysis phases
+#           are added to it as its host pair's, counting bytes written if it
+#           does. If it profiles with cProfile, so does every worker
+#
+# Returns flows with a "files" entry added to each, see analyzeFlow
+def analyzeRun(output_dir, flows, ftrace_flows, export_format='csv', workers=None, time_origin=None, clock_offset=0.0, pcap_flows=None, cache_dir=None, profiler=None):
+  ftrace_dfs = [
+    getFtraceFlow(ftrace_flows, flow['client_ip'], flow['c_port'], flow['server_ip'], flow['s_port']) for flow in flows
+  ]
+  pcap_dfs = [None] * len(flows)
+  if pcap_flows is not None:
+    pcap_dfs = [
+      getPcapFlow(pcap_flows, flow['client_ip'], flow['c_port'], flow['server_ip'], flow['s_port']) for flow in flows
+    ]
+
+  if workers is None:
+    workers = os.cpu_count() or 1
+  workers = min(workers, len(flows))
+  count_written = profiler is not None and profiler.count_written
+
+  if workers <= 1:
+    # profiled by the caller's own profiler, only one can run at a time
+    results = [
+      analyzeFlow(output_dir, flow, ftrace, export_format, time_origin, clock_offset, pcap, cache_dir, None, count_written)
+      for flow, ftrace, pcap in zip(flows, ftrace_dfs, pcap_dfs)
+    ]
+  else:
+    cprofile_paths = [None] * len(flows)
+    if profiler is not None and profiler.cprofile:
+      cprofile_paths = [output_dir + flow['result_dir'] + CPROFILE_NAME for flow in flows]
+
+    # forked workers inherit the caller's profiler, still profiling, which is
+    # stopped before each starts its own
+    initializer = profiler.dropCProfile if profiler is not None else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'), initializer=initializer) as pool:
+      results = list(pool.map(
+        analyzeFlow,
+        [output_dir] * len(flows),
+        flows,
+        ftrace_dfs,
+        [export_format] * len(flows),
+        [time_origin] * len(flows),
+        [clock_offset] * len(flows),
+        pcap_dfs,
+        [cache_dir] * len(flows),
+        cprofile_paths,
+        [count_written] * len(flows)
+      ))
+
+    for cprofile_path in cprofile_paths:
+      if cprofile_path is not None:
+        profiler.addCProfile(cprofile_path)
+
+  if profiler is not None:
+    for flow, (_, phases) in zip(flows, results):
+      profiler.addHostPair(f"{flow['client']}-{flow['server']}", phases)
+
+  return [dict(flow, files=files) for flow, (files, _) in zip(flows, results)]
+
+# Describes the flows of a run saved in run_dir before manifests were written,
+# from its host pair directories. Such runs used Mininet's default addresses,
+# where host hN is 10.0.0.N, and the default iperf3 ports.
+# Returns a list of flow dicts, as returned by HostPair.describe
+def discoverFlows(run_dir):
+  flows = []
+  for result_dir in sorted(os.listdir(run_dir)):
+    match = re.fullmatch(r'h(\d+)_h(\d+)', result_dir)
+    if match is None or not os.path.isdir(os.path.join(run_dir, result_dir)):
+      continue
+
+    iperf_log = "iperf.json" if os.path.exists(artifactPath(os.path.join(run_dir, result_dir, "iperf.json"))) else "iperf.txt"
+    flows.append({
+      'result_dir': result_dir + '/',
+      'client': f"h{match.group(1)}",
+      'server': f"h{match.group(2)}",
+      'client_ip': MININET_IP_PREFIX + match.group(1),
+      'server_ip': MININET_IP_PREFIX + match.group(2),
+      'c_port': LEGACY_C_PORT,
+      's_port': LEGACY_S_PORT,
+      'delay': 0,
+      'alg': None,
+      'iperf_log': iperf_log
+    })
+
+  return flows
+
+# Parses, exports and plots the results of the run saved in run_dir again from
+# its raw ftrace, ping, iperf3 and packet capture files, without Mininet.
+# Parsed dataframes are cached in the run's CACHE_DIR_NAME directory, so only
+# raw files that changed since the last analysis are parsed again. The run's
+# manifest is updated, or written for runs from before manifests were.
+#
+# export_format: key of utils.EXPORT_FORMATS, defaults to the run's format
+# workers: see analyzeRun
+# use_cache: if False, every raw file is parsed and nothing is cached
+# profiler: utils.RunProfiler the phases of the analysis are recorded on. If
+#           it profiles with cProfile, the statistics are saved to the run's
+#           utils.CPROFILE_NAME
+#
+# Returns the run's manifest
+def reanalyzeRun(run_dir, export_format=None, workers=None, use_cache=True, profiler=None):
+  run_dir = os.path.join(run_dir, '')
+  cache_dir = run_dir + CACHE_DIR_NAME if use_cache else None
+  if profiler is None:
+    profiler = RunProfiler()
+
+  if os.path.exists(run_dir + MANIFEST_NAME):
+    manifest = loadManifest(run_dir)
+  else:
+    manifest = {
+      'description': os.path.basename(os.path.normpath(run_dir)),
+      'ftrace': 'ftrace_raw.txt',
+      # captures by the name tcpdump was given, whether compressed or split
+      # into a ring of files
+      'captures': sorted({
+        os.path.basename(path).split(".pcap")[0] + ".pcap" for path in glob.glob(run_dir + "*_tcpdump.pcap*")
+      }),
+      'flows': discoverFlows(run_dir)
+    }
+
+  if export_format is None:
+    export_format = manifest.get('export_format', 'csv')
+  time_origin = manifest.get('time_origin')
+  clock_offset = manifest.get('clock_offset', 0.0)
+
+  profiler.startCProfile()
+  profiler.start('ftrace_parse')
+  ftrace_flows = cachedParse(cache_dir, parseFtraceFlows, run_dir + manifest['ftrace'], time_origin)
+
+  # only times measured from the run's time origin show how late a flow's
+  # trace started
+  if time_origin is not None:
+    # events are only sampled if the kernel filter could be set
+    ftrace_sample = manifest.get('ftrace_sample', 1) if manifest.get('ftrace_filter') else 1
+    manifest['incomplete_flows'] = findIncompleteFlows(manifest['flows'], ftrace_flows, ftrace_sample)
+    traceWarning(manifest.get('ftrace_loss', {'lost': 0}), manifest['incomplete_flows'])
+
+  profiler.start('pcap_parse')
+  pcap_flows = None
+  if len(manifest.get('captures', [])) > 0:
+    pcap_flows = {}
+    for capture in manifest['captures']:
+      paths = pcapFiles(run_dir + capture)
+      if len(paths) > 0:
+        pcap_flows.update(cachedParse(cache_dir, parsePcapFlows, paths, time_origin, clock_offset))
+
+  profiler.start('analysis')
+  manifest['export_format'] = export_format
+  manifest['flows'] = analyzeRun(
+    run_dir, manifest['flows'], ftrace_flows, export_format, workers, time_origin, clock_offset, pcap_flows, cache_dir, profiler
+  )
+  profiler.stop()
+  if profiler.saveCProfile(run_dir + CPROFILE_NAME) is not None:
+    manifest['cprofile'] = CPROFILE_NAME
+  saveManifest(manifest, run_dir)
+
+  return manifest
+
+# Loads the samples of the flow saved in result_dir of the run saved in
+# run_dir from start to end seconds of the run, in the same times as its
+# exported results. Only the parts of the raw ftrace and ping files covering
+# the window are read, see utils.loadFtraceWindow and utils.loadPingWindow, so
+# zooming into a long run does not parse it all again.
+# Returns (rtt, ftrace) dataframes
+def loadFlowWindow(run_dir, result_dir, start, end):
+  run_dir = os.path.join(run_dir, '')
+  result_dir = os.path.join(result_dir, '')
+  manifest = loadManifest(run_dir) if os.path.exists(run_dir + MANIFEST_NAME) else {
+    'ftrace': 'ftrace_raw.txt',
+    'flows': discoverFlows(run_dir)
+  }
+
+  flow = next((flow for flow in manifest['flows'] if flow['result_dir'] == result_dir), None)
+  if flow is None:
+    raise ValueError(f"Run {run_dir} has no flow saved in {result_dir}")
+
+  time_origin = manifest.get('time_origin')
+  clock_offset = manifest.get('clock_offset', 0.0)
+  rtt = loadPingWindow(run_dir + result_dir + "ping.txt", start, end, time_origin, clock_offset)
+
+  # without a time origin the flow's times are shifted by when it was
+  # started, as in analyzeFlow
+  shift = 0 if time_origin is not None else flow.get('start_offset', flow['delay'])
+  ftrace = loadFtraceWindow(
+    run_dir + manifest['ftrace'],
+    flow['client_ip'],
+    flow['c_port'],
+    flow['server_ip'],
+    flow['s_port'],
+    start - shift,
+    end - shift,
+    time_origin
+  )
+  ftrace['Time'] = ftrace['Time'] + shift
+
+  return rtt, ftrace
+
+if __name__ == '__main__':
+  usage = "Usage: analysis.py <run directory> [-f format] [-w workers] [-n] [-p] [-P] [-W]"
+  run_dir = None
+  export_format = None
+  workers = None
+  use_cache = True
+  record_profile = False
+  cprofile = False
+  count_written = False
+
+  args = sys.argv[1:]
+  i = 0
+  while i < len(args):
+    if args[i] == '-f' and i + 1 < len(args):
+      i += 1
+      if not exportFormatAvailable(args[i]):
+        sys.exit(f"'{args[i]}' is not an available export format")
+      export_format = args[i]
+    elif args[i] == '-w' and i + 1 < len(args):
+      i += 1
+      if not args[i].isdigit() or int(args[i]) <= 0:
+        sys.exit(f"'{args[i]}' is not a valid number of workers")
+      workers = int(args[i])
+    elif args[i] == '-n':
+      use_cache = False
+    elif args[i] == '-p':
+      record_profile = True
+    elif args[i] == '-P':
+      cprofile = True
+    elif args[i] == '-W':
+      count_written = True
+    elif run_dir is None and not args[i].startswith('-'):
+      run_dir = args[i]
+    else:
+      sys.exit(f"'{args[i]}' is not a valid option or argument. {usage}")
+    i += 1
+
+  if run_dir is None or not os.path.isdir(run_dir):
+    sys.exit(usage)
+
+  run_dir = os.path.join(run_dir, '')
+  profiler = RunProfiler(run_dir, cprofile, count_written)
+  reanalyzeRun(run_dir, export_format, workers, use_cache, profiler)
+
+  # add the analysis to the phases of the run, such as those of the capture
+  # that handed it to this process
+  if record_profile:
+    if os.path.exists(run_dir + PROFILE_NAME):
+      profiler.load(run_dir + PROFILE_NAME)
+    profiler.save(run_dir + PROFILE_NAME)
+
+  print("\n\nResults saved to the following location: " + os.path.join(run_dir, ''))
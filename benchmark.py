@@ -0,0 +1,669 @@
+import os
+import sys
+import json
+import time
+import struct
+import socket
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils import *
+from analysis import plotFlow, cachedParse
+
+DEFAULT_BENCH_DIR = "/tmp/cinspect_bench/"
+DEFAULT_BASELINE = "benchmark_baseline.json"
+DEFAULT_BENCH_EVENTS = [10 ** 4, 10 ** 6]
+DEFAULT_BENCH_FLOWS = [1, 16]
+# Version of the artifacts genRun generates. Runs generated by an earlier
+# version, missing artifacts benchmarkRun now reads, are generated again
+BENCH_RUN_VERSION = 2
+# Seconds of run the generated artifacts cover. Pings are sent and iperf3
+# reports every BENCH_INTERVAL seconds
+DEFAULT_BENCH_RUNTIME = 600
+BENCH_INTERVAL = 0.1
+# Flows plotted by the plot stage, as each plot takes about the same time
+# however long the run is
+DEFAULT_BENCH_PLOTS = 4
+# tcp_probe events generated and written at a time
+BENCH_BLOCK_EVENTS = 65536
+# Start of the generated traces on the trace clock, and of the other artifacts
+# in wall clock time
+BENCH_FTRACE_ORIGIN = 1000.0
+BENCH_WALL_ORIGIN = 1700000000.0
+# Seconds of each flow loaded by the window stages, from the middle of the run
+BENCH_WINDOW = 10.0
+# Cpus the ring buffer pages of a raw trace are spread over, as the text
+# trace's events are
+BENCH_CPUS = 4
+# Every BENCH_RETRANSMIT_EVERY th segment of a captured flow is resent, and
+# sequence numbers start at BENCH_PCAP_ISN so they wrap early in the run
+BENCH_RETRANSMIT_EVERY = 97
+BENCH_PCAP_ISN = 2 ** 32 - 2 ** 24
+# Share of tcp_probe events from sockets other than the flows, such as iperf3
+# control connections, which the parser has to skip
+BENCH_OTHER_SHARE = 0.01
+# A stage is reported as a regression if it takes longer, or grows the
+# process's memory by more, than this many times its baseline. Differences
+# below BENCH_MIN_SECONDS and BENCH_MIN_GROWTH bytes are within noise
+BENCH_TOLERANCE = 1.25
+BENCH_MIN_SECONDS = 0.05
+BENCH_MIN_GROWTH = 16 * 2 ** 20
+
+# Returns the address Mininet gives host number n in 10.0.0.0/8
+def benchIP(n):
+  return f"10.{(n >> 16) & 0xff}.{(n >> 8) & 0xff}.{n & 0xff}"
+
+# Returns the address of benchIP(n) as an integer
+def _benchIPInt(n):
+  return (10 << 24) | n
+
+# Returns a list of flow dicts, as returned by HostPair.describe, for flows
+# host pairs numbered like dumbbell.Dumbbell's
+def benchFlows(flows):
+  return [{
+    'result_dir': f"h{i + 1}_h{flows + i + 1}/",
+    'client': f"h{i + 1}",
+    'server': f"h{flows + i + 1}",
+    'client_ip': benchIP(i + 1),
+    'server_ip': benchIP(flows + i + 1),
+    'c_port': str(5201 + i),
+    's_port': str(5001 + i),
+    'delay': 0,
+    'start_offset': 0.0,
+    'alg': None,
+    'iperf_log': "iperf.json"
+  } for i in range(flows)]
+
+# Text columns of BENCH_BLOCK_EVENTS lines are built as a (lines, width) byte
+# array and a mask of the bytes each line uses, joined side by side and read
+# out in order, so lines are formatted without a python loop over them
+_DIGIT_BYTES = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+# Returns the text column of the string text on every one of count lines
+def _constantColumn(text, count):
+  chars = np.broadcast_to(np.frombuffer(text.encode(), dtype=np.uint8), (count, len(text)))
+  return chars, np.ones(chars.shape, dtype=bool)
+
+# Returns the text column of strings[keys], for an integer array keys
+def _tableColumn(strings, keys):
+  width = max(len(string) for string in strings)
+  chars = np.zeros((len(strings), width), dtype=np.uint8)
+  used = np.zeros((len(strings), width), dtype=bool)
+  for row, string in enumerate(strings):
+    chars[row, :len(string)] = np.frombuffer(string.encode(), dtype=np.uint8)
+    used[row, :len(string)] = True
+
+  return chars[keys], used[keys]
+
+# Returns the text column of the array values, each below 2^32, in base 10
+# or 16, without leading zeros, or zero padded to width digits if given
+def _numberColumn(values, base=10, width=None):
+  # 32 bit division is much faster, and fits every generated field
+  values = values.astype(np.uint32)
+  padded = width is not None
+  if not padded:
+    top = int(values.max(initial=0))
+    width = 1
+    while top >= base ** width:
+      width += 1
+
+  powers = np.array([base ** power for power in range(width - 1, -1, -1)], dtype=np.uint32)
+  digits = (values[:, None] // powers) % np.uint32(base)
+  if padded:
+    used = np.ones(digits.shape, dtype=bool)
+  else:
+    used = np.logical_or.accumulate(digits != 0, axis=1)
+    used[:, -1] = True
+
+  return _DIGIT_BYTES[digits], used
+
+# Returns the text column of columns placed side by side
+def _joinColumns(columns):
+  chars = np.concatenate([chars for chars, _ in columns], axis=1)
+  used = np.concatenate([used for _, used in columns], axis=1)
+  return chars, used
+
+# Returns the fields of tcp_probe events i of a trace of events events spread
+# evenly over runtime seconds and over flows flows, as (flow, sample number
+# within the flow, times, cwnd, ssthresh, srtt, snd_una) arrays. Each flow's
+# CWND follows a sawtooth and its SRTT varies
+def _probeFields(i, events, flows, runtime):
+  flow = i % flows
+  sample = i // flows
+  times = BENCH_FTRACE_ORIGIN + i * (runtime / events)
+  cwnd = 10 + (sample * 7 // 5) % 400
+  ssthresh = np.where(sample < 400, 2147483647, 280)
+  srtt = 20000 + (sample * 37) % 8000
+  snd_una = (sample * 1448) & 0xffffffff
+  return flow, sample, times, cwnd, ssthresh, srtt, snd_una
+
+# Writes a text ftrace trace of events tcp_probe events from flows, as saved
+# by saveFtrace, to path, with the events of _probeFields and about
+# BENCH_OTHER_SHARE of events from other sockets. Generating takes about 2
+# seconds per million events, but each event is about 240 bytes of trace, so
+# 10^8 events take about 24 GB of disk
+def genFtrace(path, events, flows, runtime=DEFAULT_BENCH_RUNTIME):
+  flow_list = benchFlows(flows)
+  lines_total = int(events * (1 + BENCH_OTHER_SHARE))
+  other_every = max(1, int(1 / BENCH_OTHER_SHARE)) if BENCH_OTHER_SHARE > 0 else 0
+
+  # the text of each flow's lines between their variable fields
+  heads = [f"          iperf3-{1000 + k}  [{k % BENCH_CPUS:03d}] ..s1  " for k in range(flows)]
+  probes = [
+    f": tcp_probe: src={f['client_ip']}:{f['c_port']} dest={f['server_ip']}:{f['s_port']} mark=0x0 data_len=1448 snd_nxt="
+    for f in flow_list
+  ]
+  tails = [f" rcv_wnd=65160 sock_cookie={k + 1:x}\n" for k in range(flows)]
+  others = [
+    f": tcp_probe: src={f['client_ip']}:{40000 + k} dest={f['server_ip']}:{f['s_port']} mark=0x0 data_len=0 snd_nxt=0x1 snd_una=0x1 "
+    f"snd_cwnd=10 ssthresh=2147483647 snd_wnd=64256 srtt=100 rcv_wnd=65160 sock_cookie={flows + k + 1:x}\n"
+    for k, f in enumerate(flow_list)
+  ]
+
+  def hexColumns(values):
+    return [_constantColumn("0x", len(values)), _numberColumn(values, 16)]
+
+  with open(path, 'wb') as ftrace_file:
+    ftrace_file.write(f"# tracer: nop\n#\n# entries-in-buffer/entries-written: {lines_total}/{lines_total}   #P:{BENCH_CPUS}\n#\n".encode())
+    for start in range(0, events, BENCH_BLOCK_EVENTS):
+      i = np.arange(start, min(events, start + BENCH_BLOCK_EVENTS))
+      flow, sample, times, cwnd, ssthresh, srtt, snd_una = _probeFields(i, events, flows, runtime)
+
+      # timestamps with 6 decimals, from whole microseconds
+      micros = np.round(times * 1e6).astype(np.int64)
+      stamp = [_numberColumn(micros // 10 ** 6), _constantColumn(".", len(i)), _numberColumn(micros % 10 ** 6, width=6)]
+
+      chars, used = _joinColumns(
+        [_tableColumn(heads, flow)] + stamp + [_tableColumn(probes, flow)] +
+        hexColumns((snd_una + 14480) & 0xffffffff) + [_constantColumn(" snd_una=", len(i))] + hexColumns(snd_una) + [
+          _constantColumn(" snd_cwnd=", len(i)),
+          _numberColumn(cwnd),
+          _constantColumn(" ssthresh=", len(i)),
+          _numberColumn(ssthresh),
+          _constantColumn(" snd_wnd=3145728 srtt=", len(i)),
+          _numberColumn(srtt),
+          _tableColumn(tails, flow)
+        ]
+      )
+
+      # each other socket's event follows the flow event it was sent with
+      if other_every:
+        sent = np.flatnonzero(i % other_every == 0)
+        other_chars, other_used = _joinColumns(
+          [_tableColumn(heads, flow[sent])] + [(c[sent], u[sent]) for c, u in stamp] + [_tableColumn(others, flow[sent])]
+        )
+        width = max(chars.shape[1], other_chars.shape[1])
+        rows = len(i) + len(sent)
+        merged_chars = np.zeros((rows, width), dtype=np.uint8)
+        merged_used = np.zeros((rows, width), dtype=bool)
+        flow_rows = np.arange(len(i)) + np.searchsorted(sent, np.arange(len(i)))
+        other_rows = sent + np.arange(len(sent)) + 1
+        merged_chars[flow_rows, :chars.shape[1]] = chars
+        merged_used[flow_rows, :chars.shape[1]] = used
+        merged_chars[other_rows, :other_chars.shape[1]] = other_chars
+        merged_used[other_rows, :other_chars.shape[1]] = other_used
+        chars, used = merged_chars, merged_used
+
+      ftrace_file.write(chars[used].tobytes())
+
+# Layout of the ring buffer pages and tcp_probe events of a generated raw
+# trace, as saved by RawFtraceStreamer from a kernel with 4096 byte pages
+BENCH_HEADER_PAGE = """\tfield: u64 timestamp;\toffset:0;\tsize:8;\tsigned:0;
+\tfield: local_t commit;\toffset:8;\tsize:8;\tsigned:1;
+\tfield: int overwrite;\toffset:8;\tsize:1;\tsigned:1;
+\tfield: char data;\toffset:16;\tsize:4080;\tsigned:1;
+"""
+BENCH_TCP_PROBE_ID = 1234
+BENCH_TCP_PROBE_FORMAT = f"""name: tcp_probe
+ID: {BENCH_TCP_PROBE_ID}
+format:
+\tfield:unsigned short common_type;\toffset:0;\tsize:2;\tsigned:0;
+\tfield:unsigned char common_flags;\toffset:2;\tsize:1;\tsigned:0;
+\tfield:unsigned char common_preempt_count;\toffset:3;\tsize:1;\tsigned:0;
+\tfield:int common_pid;\toffset:4;\tsize:4;\tsigned:1;
+
+\tfield:__u8 saddr[sizeof(struct sockaddr_in6)];\toffset:8;\tsize:28;\tsigned:0;
+\tfield:__u8 daddr[sizeof(struct sockaddr_in6)];\toffset:36;\tsize:28;\tsigned:0;
+\tfield:__u16 sport;\toffset:64;\tsize:2;\tsigned:0;
+\tfield:__u16 dport;\toffset:66;\tsize:2;\tsigned:0;
+\tfield:__u32 mark;\toffset:68;\tsize:4;\tsigned:0;
+\tfield:__u16 data_len;\toffset:72;\tsize:2;\tsigned:0;
+\tfield:__u32 snd_nxt;\toffset:76;\tsize:4;\tsigned:0;
+\tfield:__u32 snd_una;\toffset:80;\tsize:4;\tsigned:0;
+\tfield:__u32 snd_cwnd;\toffset:84;\tsize:4;\tsigned:0;
+\tfield:__u32 ssthresh;\toffset:88;\tsize:4;\tsigned:0;
+\tfield:__u32 snd_wnd;\toffset:92;\tsize:4;\tsigned:0;
+\tfield:__u32 srtt;\toffset:96;\tsize:4;\tsigned:0;
+\tfield:__u32 rcv_wnd;\toffset:100;\tsize:4;\tsigned:0;
+\tfield:__u64 sock_cookie;\toffset:104;\tsize:8;\tsigned:0;
+
+print fmt: "src=%pISpc dest=%pISpc"
+"""
+BENCH_PAGE_SIZE = 4096
+BENCH_PAGE_HEADER_SIZE = 16
+# Fields of a struct sockaddr_in6 sized tcp_probe address holding an IPv4
+# address
+_SOCKADDR_FIELDS = [('family', '<u2'), ('port', '>u2'), ('addr', '>u4'), ('zero', 'V20')]
+# A tcp_probe event as laid out by BENCH_TCP_PROBE_FORMAT, after its 4 byte
+# event header
+_PROBE_FIELDS = [
+  ('header', '<u4'), ('common_type', '<u2'), ('common_flags', 'u1'), ('common_preempt_count', 'u1'), ('common_pid', '<i4'),
+  ('saddr', _SOCKADDR_FIELDS), ('daddr', _SOCKADDR_FIELDS), ('sport', '<u2'), ('dport', '<u2'), ('mark', '<u4'),
+  ('data_len', '<u2'), ('pad', 'V2'), ('snd_nxt', '<u4'), ('snd_una', '<u4'), ('snd_cwnd', '<u4'), ('ssthresh', '<u4'),
+  ('snd_wnd', '<u4'), ('srtt', '<u4'), ('rcv_wnd', '<u4'), ('sock_cookie', '<u8')
+]
+# The same event after a time extend record, carrying the time since the one
+# before when it is too long for the event header
+_EXTENDED_PROBE_FIELDS = [('extend', '<u4'), ('extend_high', '<u4')] + _PROBE_FIELDS
+# Length of an event's data in words, given in its header
+_PROBE_WORDS = (np.dtype(_PROBE_FIELDS).itemsize - 4) // 4
+
+# Returns the ring buffer pages holding events, a structured array of
+# _PROBE_FIELDS whose headers are filled in from times, their timestamps in
+# ns, as a byte string. Each page starts at the time of its first event, the
+# last page is left part full. If events are too far apart for the time delta
+# of their headers, each follows a time extend record instead
+def _rawPages(events, times):
+  deltas = np.diff(times, prepend=times[:1])
+  extend = len(times) > 0 and deltas.max() >= 1 << RB_TS_SHIFT
+  fields = _EXTENDED_PROBE_FIELDS if extend else _PROBE_FIELDS
+  per_page = (BENCH_PAGE_SIZE - BENCH_PAGE_HEADER_SIZE) // np.dtype(fields).itemsize
+  first = np.arange(0, len(events), per_page)
+  deltas[first] = 0
+
+  if extend:
+    extended = np.zeros(len(events), dtype=fields)
+    for name, _ in _PROBE_FIELDS:
+      extended[name] = events[name]
+    extended['extend'] = ((deltas & ((1 << RB_TS_SHIFT) - 1)) << 5) | RB_TYPE_TIME_EXTEND
+    extended['extend_high'] = deltas >> RB_TS_SHIFT
+    events, deltas = extended, np.zeros_like(deltas)
+  events['header'] = (deltas << 5) | _PROBE_WORDS
+
+  data = np.zeros((len(first), per_page * events.itemsize), dtype=np.uint8)
+  data.reshape(-1)[:events.nbytes] = events.view(np.uint8)
+  pages = np.zeros((len(first), BENCH_PAGE_SIZE), dtype=np.uint8)
+  pages[:, :8] = times[first].astype('<u8')[:, None].view(np.uint8)
+  commit = np.minimum(len(events) - first, per_page) * events.itemsize
+  pages[:, 8:16] = commit.astype('<u8')[:, None].view(np.uint8)
+  pages[:, BENCH_PAGE_HEADER_SIZE:BENCH_PAGE_HEADER_SIZE + data.shape[1]] = data
+  return pages.tobytes()
+
+# Writes a raw trace of the same events as genFtrace to raw_dir, as saved by
+# RawFtraceStreamer: the page and tcp_probe layouts, and the ring buffer pages
+# of the events of each of BENCH_CPUS cpus, each flow's events on one cpu.
+# Each event takes 116 bytes, half the size of its text
+def genRawFtrace(raw_dir, events, flows, runtime=DEFAULT_BENCH_RUNTIME):
+  checkDir(raw_dir)
+  with open(raw_dir + RAW_HEADER_PAGE_NAME, 'w') as header_file:
+    header_file.write(BENCH_HEADER_PAGE)
+  with open(raw_dir + RAW_FORMAT_NAME, 'w') as format_file:
+    format_file.write(BENCH_TCP_PROBE_FORMAT)
+
+  flow_list = benchFlows(flows)
+  client_ips = np.array([_benchIPInt(k + 1) for k in range(flows)])
+  server_ips = np.array([_benchIPInt(flows + k + 1) for k in range(flows)])
+  c_ports = np.array([int(f['c_port']) for f in flow_list])
+  s_ports = np.array([int(f['s_port']) for f in flow_list])
+  other_every = max(1, int(1 / BENCH_OTHER_SHARE)) if BENCH_OTHER_SHARE > 0 else 0
+
+  cpu_files = [open(raw_dir + f"cpu{cpu}.raw", 'wb') for cpu in range(BENCH_CPUS)]
+  try:
+    for start in range(0, events, BENCH_BLOCK_EVENTS):
+      i = np.arange(start, min(events, start + BENCH_BLOCK_EVENTS))
+      flow, sample, times, cwnd, ssthresh, srtt, snd_una = _probeFields(i, events, flows, runtime)
+
+      # each other socket's event follows the flow event it was sent with
+      sent = np.flatnonzero(i % other_every == 0) if other_every else np.array([], dtype=np.int64)
+      rows = np.concatenate((np.arange(len(i)), sent))
+      other = np.concatenate((np.zeros(len(i), dtype=bool), np.ones(len(sent), dtype=bool)))
+      order = np.argsort(rows, kind='stable')
+      rows, other = rows[order], other[order]
+      flow = flow[rows]
+
+      probes = np.zeros(len(rows), dtype=_PROBE_FIELDS)
+      probes['common_type'] = BENCH_TCP_PROBE_ID
+      probes['common_pid'] = 1000 + flow
+      probes['saddr']['family'] = probes['daddr']['family'] = socket.AF_INET
+      probes['saddr']['addr'] = client_ips[flow]
+      probes['saddr']['port'] = probes['sport'] = np.where(other, 40000 + flow, c_ports[flow])
+      probes['daddr']['addr'] = server_ips[flow]
+      probes['daddr']['port'] = probes['dport'] = s_ports[flow]
+      probes['data_len'] = np.where(other, 0, 1448)
+      probes['snd_nxt'] = np.where(other, 1, (snd_una[rows] + 14480) & 0xffffffff)
+      probes['snd_una'] = np.where(other, 1, snd_una[rows])
+      probes['snd_cwnd'] = np.where(other, 10, cwnd[rows])
+      probes['ssthresh'] = np.where(other, 2147483647, ssthresh[rows])
+      probes['snd_wnd'] = np.where(other, 64256, 3145728)
+      probes['srtt'] = np.where(other, 100, srtt[rows])
+      probes['rcv_wnd'] = 65160
+      probes['sock_cookie'] = np.where(other, flows + flow + 1, flow + 1)
+
+      stamps = np.round(times[rows] * 1e9).astype(np.int64)
+      for cpu, cpu_file in enumerate(cpu_files):
+        on_cpu = flow % BENCH_CPUS == cpu
+        cpu_file.write(_rawPages(probes[on_cpu], stamps[on_cpu]))
+  finally:
+    for cpu_file in cpu_files:
+      cpu_file.close()
+
+# A pcap record of an Ethernet framed IPv4 TCP segment, cut to its headers
+_PCAP_SEGMENT_FIELDS = [
+  ('ts_sec', '<u4'), ('ts_usec', '<u4'), ('incl_len', '<u4'), ('orig_len', '<u4'),
+  ('eth_addrs', 'V12'), ('ethertype', '>u2'),
+  ('version_ihl', 'u1'), ('tos', 'u1'), ('total_len', '>u2'), ('ip_id', '>u2'), ('frag', '>u2'), ('ttl', 'u1'),
+  ('protocol', 'u1'), ('ip_checksum', '>u2'), ('src', '>u4'), ('dest', '>u4'),
+  ('sport', '>u2'), ('dport', '>u2'), ('seq', '>u4'), ('ack', '>u4'), ('data_offset', 'u1'), ('flags', 'u1'),
+  ('window', '>u2'), ('tcp_checksum', '>u2'), ('urgent', '>u2')
+]
+# Bytes of a segment's headers, kept by the capture, and of its IP and TCP
+# headers
+_PCAP_HEADERS_SIZE = np.dtype(_PCAP_SEGMENT_FIELDS).itemsize - PCAP_RECORD_SIZE
+_PCAP_IP_SIZE = _PCAP_HEADERS_SIZE - PCAP_LINK_TYPES[1][0]
+
+# Writes a capture of the flows' segments, cut to their headers as tcpdump
+# does given a snaplen, to path. Each tcp_probe event of genFtrace is a data
+# segment sent at the same time, every BENCH_RETRANSMIT_EVERY th of a flow is
+# resent, and every second one is acknowledged half way to the next event.
+# Sequence numbers start at BENCH_PCAP_ISN, wrapping early in the run. Each
+# event takes about 105 bytes of capture
+def genPcap(path, events, flows, runtime=DEFAULT_BENCH_RUNTIME):
+  flow_list = benchFlows(flows)
+  client_ips = np.array([_benchIPInt(k + 1) for k in range(flows)])
+  server_ips = np.array([_benchIPInt(flows + k + 1) for k in range(flows)])
+  c_ports = np.array([int(f['c_port']) for f in flow_list])
+  s_ports = np.array([int(f['s_port']) for f in flow_list])
+  spacing = runtime / events
+
+  with open(path, 'wb') as pcap_file:
+    pcap_file.write(struct.pack('<IHHiIII', PCAP_MAGIC_USEC, 2, 4, 0, 0, 65535, 1))
+    for start in range(0, events, BENCH_BLOCK_EVENTS):
+      i = np.arange(start, min(events, start + BENCH_BLOCK_EVENTS))
+      flow, sample, times, _, _, _, _ = _probeFields(i, events, flows, runtime)
+      end = (BENCH_PCAP_ISN + (sample + 1) * TCP_MSS) & 0xffffffff
+      resent = sample % BENCH_RETRANSMIT_EVERY == BENCH_RETRANSMIT_EVERY - 1
+      acked = sample % 2 == 1
+
+      # each event's segment, then its retransmit and ACK if it has them
+      counts = 1 + resent + acked
+      data_at = np.cumsum(counts) - counts
+      data = np.concatenate((data_at, data_at[resent] + 1))
+      data_event = np.concatenate((np.arange(len(i)), np.flatnonzero(resent)))
+      ack = data_at[acked] + 1 + resent[acked]
+      ack_event = np.flatnonzero(acked)
+
+      segments = np.zeros(counts.sum(), dtype=_PCAP_SEGMENT_FIELDS)
+      segments['ethertype'] = ETHERTYPE_IPV4
+      segments['version_ihl'] = 0x45
+      segments['ttl'] = 64
+      segments['protocol'] = socket.IPPROTO_TCP
+      segments['data_offset'] = 5 << 4
+      segments['window'] = 65535
+      segments['incl_len'] = _PCAP_HEADERS_SIZE
+
+      stamps = (times - BENCH_FTRACE_ORIGIN + BENCH_WALL_ORIGIN) * 1e6
+      stamps = np.round(np.concatenate((stamps[data_event], stamps[ack_event] + spacing * 5e5))).astype(np.int64)
+      at = np.concatenate((data, ack))
+      segments['ts_sec'][at] = stamps // 10 ** 6
+      segments['ts_usec'][at] = stamps % 10 ** 6
+
+      data_flow = flow[data_event]
+      segments['src'][data] = client_ips[data_flow]
+      segments['dest'][data] = server_ips[data_flow]
+      segments['sport'][data] = c_ports[data_flow]
+      segments['dport'][data] = s_ports[data_flow]
+      segments['seq'][data] = (end[data_event] - TCP_MSS) & 0xffffffff
+      segments['ack'][data] = 1
+      segments['flags'][data] = 0x18
+      segments['total_len'][data] = _PCAP_IP_SIZE + TCP_MSS
+      segments['orig_len'][data] = _PCAP_HEADERS_SIZE + TCP_MSS
+
+      ack_flow = flow[ack_event]
+      segments['src'][ack] = server_ips[ack_flow]
+      segments['dest'][ack] = client_ips[ack_flow]
+      segments['sport'][ack] = s_ports[ack_flow]
+      segments['dport'][ack] = c_ports[ack_flow]
+      segments['seq'][ack] = 1
+      segments['ack'][ack] = end[ack_event]
+      segments['flags'][ack] = 0x10
+      segments['total_len'][ack] = _PCAP_IP_SIZE
+      segments['orig_len'][ack] = _PCAP_HEADERS_SIZE
+
+      pcap_file.write(segments.tobytes())
+
+# Writes the output of "ping -D" over runtime seconds, a reply every
+# BENCH_INTERVAL seconds with every 97th lost, to path
+def genPing(path, dest_ip, runtime=DEFAULT_BENCH_RUNTIME):
+  count = int(runtime / BENCH_INTERVAL)
+  seqs = np.arange(1, count + 1)
+  seqs = seqs[seqs % 97 != 0]
+  times = BENCH_WALL_ORIGIN + seqs * BENCH_INTERVAL
+  rtts = 20 + (seqs * 13 % 800) / 100
+
+  with open(path, 'w') as ping_file:
+    ping_file.write(f"PING {dest_ip} ({dest_ip}) 56(84) bytes of data.\n")
+    ping_file.write("".join(
+      f"[{t:.6f}] 64 bytes from {dest_ip}: icmp_seq={s} ttl=64 time={r:.2f} ms\n"
+      for t, s, r in zip(times.tolist(), seqs.tolist(), rtts.tolist())
+    ))
+
+# Writes iperf3 JSON output with a report every BENCH_INTERVAL seconds over
+# runtime seconds to path
+def genIperfJSON(path, runtime=DEFAULT_BENCH_RUNTIME):
+  intervals = []
+  for i in range(int(runtime / BENCH_INTERVAL)):
+    start, end = i * BENCH_INTERVAL, (i + 1) * BENCH_INTERVAL
+    interval_sum = {
+      'start': start, 'end': end, 'seconds': BENCH_INTERVAL, 'bytes': 1250000, 'bits_per_second': 1e8,
+      'retransmits': int(i % 50 == 0), 'omitted': False, 'sender': True
+    }
+    stream = dict(interval_sum, socket=5, snd_cwnd=14480 * (10 + i % 400), rtt=20000 + i * 37 % 8000, rttvar=500, pmtu=1500)
+    intervals.append({'streams': [stream], 'sum': interval_sum})
+
+  with open(path, 'w') as iperf_file:
+    json.dump({'start': {'timestamp': {'timesecs': int(BENCH_WALL_ORIGIN)}}, 'intervals': intervals, 'end': {}}, iperf_file)
+
+# Generates the raw artifacts of a run with flows flows and events tcp_probe
+# events in bench_dir, unless they were already generated: a text and a raw
+# trace, a bottleneck capture, and each flow's ping log and iperf3 output.
+# Returns the directory the run was generated in
+def genRun(bench_dir, events, flows, runtime=DEFAULT_BENCH_RUNTIME):
+  run_dir = os.path.join(bench_dir, f"run_{events}x{flows}_{runtime}s", '')
+  done_path = run_dir + ".generated"
+  if os.path.exists(done_path):
+    with open(done_path, 'r') as done_file:
+      if done_file.read() == str(BENCH_RUN_VERSION):
+        return run_dir
+
+  checkDir(run_dir)
+  print(f"Generating a run of {events} events from {flows} flows in {run_dir}")
+  genFtrace(run_dir + "ftrace_raw.txt", events, flows, runtime)
+  genRawFtrace(run_dir + "ftrace_raw/", events, flows, runtime)
+  genPcap(run_dir + "bottleneck_tcpdump.pcap", events, flows, runtime)
+  for flow in benchFlows(flows):
+    checkDir(run_dir + flow['result_dir'])
+    genPing(run_dir + flow['result_dir'] + "ping.txt", flow['server_ip'], runtime)
+    genIperfJSON(run_dir + flow['result_dir'] + flow['iperf_log'], runtime)
+
+  with open(done_path, 'w') as done_file:
+    done_file.write(str(BENCH_RUN_VERSION))
+  return run_dir
+
+# Runs fn, recording its duration, the peak resident set size of this process
+# while it ran and how far that peak rose above the size it started at in
+# results under stage.
+# Returns what fn returned
+def _measure(results, stage, fn, items):
+  resetPeakRSS()
+  rss = procStatus("VmRSS")
+  started = time.perf_counter()
+  value = fn()
+  duration = time.perf_counter() - started
+  peak = procStatus("VmHWM")
+
+  results[stage] = {'duration': duration, 'peak_rss': peak, 'rss_growth': peak - rss, 'items': items}
+  return value
+
+# Times and measures the memory use of the parse, cache, window, export and
+# plot stages on the run of runtime seconds generated in run_dir, exporting in
+# export_format and plotting plots flows. The window stages load BENCH_WINDOW
+# seconds of every flow from the middle of the run, and the cache stages parse
+# the text trace into an empty cache and load it back.
+# Returns a dict of measurements keyed by stage
+def benchmarkRun(run_dir, flows, export_format='csv', plots=DEFAULT_BENCH_PLOTS, runtime=DEFAULT_BENCH_RUNTIME):
+  flow_list = benchFlows(flows)
+  out_dir = run_dir + "out/"
+  for flow in flow_list:
+    checkDir(out_dir + flow['result_dir'])
+  results = {}
+
+  ftrace_flows = _measure(results, 'ftrace_parse', lambda: parseFtraceFlows(run_dir + "ftrace_raw.txt"), flows)
+  ftrace_dfs = [getFtraceFlow(ftrace_flows, f['client_ip'], f['c_port'], f['server_ip'], f['s_port']) for f in flow_list]
+  _measure(results, 'raw_ftrace_parse', lambda: parseFtraceFlows(run_dir + "ftrace_raw/", BENCH_FTRACE_ORIGIN), flows)
+  _measure(results, 'pcap_parse', lambda: parsePcapFlows(pcapFiles(run_dir + "bottleneck_tcpdump.pcap")), flows)
+
+  cache_dir = out_dir + "cache/"
+  shutil.rmtree(cache_dir, ignore_errors=True)
+  _measure(results, 'cache_store', lambda: cachedParse(cache_dir, parseFtraceFlows, run_dir + "ftrace_raw.txt"), flows)
+  _measure(results, 'cache_load', lambda: cachedParse(cache_dir, parseFtraceFlows, run_dir + "ftrace_raw.txt"), flows)
+
+  def window(ftrace_out, time_origin):
+    start = runtime / 2
+    return [
+      loadFtraceWindow(ftrace_out, f['client_ip'], f['c_port'], f['server_ip'], f['s_port'], start, start + BENCH_WINDOW, time_origin)
+      for f in flow_list
+    ]
+  _measure(results, 'ftrace_window', lambda: window(run_dir + "ftrace_raw.txt", BENCH_FTRACE_ORIGIN), flows)
+  _measure(results, 'raw_ftrace_window', lambda: window(run_dir + "ftrace_raw/", BENCH_FTRACE_ORIGIN), flows)
+
+  rtt_dfs = _measure(results, 'ping_parse', lambda: [getRTTs(run_dir + f['result_dir'] + "ping.txt") for f in flow_list], flows)
+  iperf_dfs = _measure(results, 'iperf_parse', lambda: [parseIperfJSON(run_dir + f['result_dir'] + f['iperf_log']) for f in flow_list], flows)
+
+  def export():
+    for flow, ftrace, rtt, iperf in zip(flow_list, ftrace_dfs, rtt_dfs, iperf_dfs):
+      dfExport(ftrace, out_dir + flow['result_dir'] + "ftrace", export_format)
+      dfExport(rtt, out_dir + flow['result_dir'] + "ping", export_format)
+      dfExport(iperf, out_dir + flow['result_dir'] + "iperf", export_format)
+  _measure(results, 'export', export, flows)
+
+  def plot():
+    for flow, ftrace, rtt, iperf in list(zip(flow_list, ftrace_dfs, rtt_dfs, iperf_dfs))[:plots]:
+      plotFlow(rtt, ftrace, f"CWND and RTT for {flow['client']}-{flow['server']} flow", out_dir + flow['result_dir'] + "graph.png", iperf)
+  _measure(results, 'plot', plot, min(plots, flows))
+
+  return results
+
+# Generates, if needed, and benchmarks a run of events tcp_probe events from
+# flows flows. Run in a fresh worker process by runBenchmarks, so memory left
+# over from one size is not counted towards the next.
+# Returns a dict of measurements keyed by "stage@<events>x<flows>"
+def benchmarkSize(bench_dir, events, flows, runtime, export_format, plots):
+  run_dir = genRun(bench_dir, events, flows, runtime)
+  results = benchmarkRun(run_dir, flows, export_format, plots, runtime)
+  return {f"{stage}@{events}x{flows}": result for stage, result in results.items()}
+
+# Benchmarks every combination of event_counts and flow_counts, each in its
+# own worker process. Generated runs are kept in bench_dir and reused.
+# Returns a dict of measurements keyed by "stage@<events>x<flows>"
+def runBenchmarks(bench_dir=DEFAULT_BENCH_DIR, event_counts=DEFAULT_BENCH_EVENTS, flow_counts=DEFAULT_BENCH_FLOWS, runtime=DEFAULT_BENCH_RUNTIME, export_format='csv', plots=DEFAULT_BENCH_PLOTS):
+  results = {}
+  for events in event_counts:
+    for flows in flow_counts:
+      with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as pool:
+        results.update(pool.submit(benchmarkSize, bench_dir, events, flows, runtime, export_format, plots).result())
+
+  return results
+
+# Prints results against baseline, a dict of earlier results with the same
+# keys, marking stages slower or growing memory by more than BENCH_TOLERANCE
+# times their baseline.
+# Returns the keys of those stages
+def compareBaseline(results, baseline):
+  regressions = []
+  print(f"\n{'stage':<32} {'time (s)':>10} {'baseline':>10} {'ratio':>7} {'RSS growth (MB)':>16} {'baseline':>10}")
+  for key, result in results.items():
+    base = baseline.get(key)
+    line = f"{key:<32} {result['duration']:>10.3f} "
+    if base is None:
+      print(line + f"{'-':>10} {'-':>7} {result['rss_growth'] / 2 ** 20:>16.1f} {'-':>10}")
+      continue
+
+    ratio = result['duration'] / base['duration'] if base['duration'] > 0 else 1.0
+    slower = ratio > BENCH_TOLERANCE and result['duration'] - base['duration'] > BENCH_MIN_SECONDS
+    larger = result['rss_growth'] > base['rss_growth'] * BENCH_TOLERANCE + BENCH_MIN_GROWTH
+    if slower or larger:
+      regressions.append(key)
+    print(line + f"{base['duration']:>10.3f} {ratio:>7.2f} {result['rss_growth'] / 2 ** 20:>16.1f} {base['rss_growth'] / 2 ** 20:>10.1f}" + ("  REGRESSION" if slower or larger else ""))
+
+  return regressions
+
+if __name__ == '__main__':
+  usage = "Usage: benchmark.py [-e events,...] [-n flows,...] [-t runtime] [-f format] [-p plots] [-d bench directory] [-b baseline] [-s]"
+  bench_dir = DEFAULT_BENCH_DIR
+  baseline_path = DEFAULT_BASELINE
+  event_counts = DEFAULT_BENCH_EVENTS
+  flow_counts = DEFAULT_BENCH_FLOWS
+  runtime = DEFAULT_BENCH_RUNTIME
+  export_format = 'csv'
+  plots = DEFAULT_BENCH_PLOTS
+  save_baseline = False
+
+  args = sys.argv[1:]
+  i = 0
+  while i < len(args):
+    if args[i] == '-e' and i + 1 < len(args):
+      i += 1
+      if not all(count.isdigit() and int(count) > 0 for count in args[i].split(',')):
+        sys.exit(f"'{args[i]}' is not a valid list of event counts")
+      event_counts = [int(count) for count in args[i].split(',')]
+    elif args[i] == '-n' and i + 1 < len(args):
+      i += 1
+      if not all(count.isdigit() and int(count) > 0 for count in args[i].split(',')):
+        sys.exit(f"'{args[i]}' is not a valid list of flow counts")
+      flow_counts = [int(count) for count in args[i].split(',')]
+    elif args[i] == '-t' and i + 1 < len(args):
+      i += 1
+      if not args[i].isdigit() or int(args[i]) <= 0:
+        sys.exit(f"'{args[i]}' is not a valid runtime")
+      runtime = int(args[i])
+    elif args[i] == '-p' and i + 1 < len(args):
+      i += 1
+      if not args[i].isdigit():
+        sys.exit(f"'{args[i]}' is not a valid number of flows to plot")
+      plots = int(args[i])
+    elif args[i] == '-f' and i + 1 < len(args):
+      i += 1
+      if not exportFormatAvailable(args[i]):
+        sys.exit(f"'{args[i]}' is not an available export format")
+      export_format = args[i]
+    elif args[i] == '-d' and i + 1 < len(args):
+      i += 1
+      bench_dir = os.path.join(args[i], '')
+    elif args[i] == '-b' and i + 1 < len(args):
+      i += 1
+      baseline_path = args[i]
+    elif args[i] == '-s':
+      save_baseline = True
+    else:
+      sys.exit(f"'{args[i]}' is not a valid option. {usage}")
+    i += 1
+
+  results = runBenchmarks(bench_dir, event_counts, flow_counts, runtime, export_format, plots)
+  with open(bench_dir + "results.json", 'w') as results_file:
+    json.dump(results, results_file, indent=2)
+
+  baseline = {}
+  if os.path.exists(baseline_path):
+    with open(baseline_path, 'r') as baseline_file:
+      baseline = json.load(baseline_file)
+  regressions = compareBaseline(results, baseline)
+
+  if save_baseline:
+    with open(baseline_path, 'w') as baseline_file:
+      json.dump({**baseline, **results}, baseline_file, indent=2)
+    print(f"\nBaseline saved to {baseline_path}")
+  elif len(regressions) > 0:
+    sys.exit(f"\n{len(regressions)} stages regressed beyond {BENCH_TOLERANCE:.2f} times their baseline")
@@ -1,7 +1,6 @@
 # Author: Joshua Woelfel
 # jwolf083@mtroyal.ca
 
-from mininet.net import Mininet
 from mininet.util import dumpNodeConnections, dumpNetConnections
 
 import sys
@@ -10,13 +9,15 @@ import time
 from time import sleep
 import os
 import signal
-import matplotlib.pyplot as plt
 import csv
-import pandas as pd
-import threading
+import asyncio
 
+# utils only loads numpy, its parsers import pandas when they build dataframes.
+# analysis, which loads matplotlib, is imported where runs are analyzed, so a
+# capture handing its runs to an AnalysisPipeline loads neither
 from utils import *
-from dumbbell import Dumbbell
+from monitor import LiveMonitor
+from dumbbell import Dumbbell, startNetwork
 from dumbbell import LINK_CONFIG as lc
 
 DEFAULT_RUNTIME = "5"
@@ -24,9 +25,52 @@ DEFAULT_LINK_CONFIG = 'DB_S'
 DEFAULT_NUM_HOST_PAIRS = 1
 DEFAULT_ALGS = []
 DEFAULT_DELAYS = [0]
+DEFAULT_STREAM_FTRACE = False
+DEFAULT_EXPORT_FORMAT = 'csv'
+# None uses one post-processing worker per cpu
+DEFAULT_WORKERS = None
+DEFAULT_FTRACE_INSTANCE = False
+DEFAULT_C_PORT = '5201'
+DEFAULT_S_PORT = '5001'
+DEFAULT_IPERF_JSON = False
+# None uses iperf3's default 1 second reporting interval
+DEFAULT_IPERF_INTERVAL = None
+# None batches link configuration from dumbbell.BATCH_LINKS_THRESHOLD host
+# pairs on
+DEFAULT_BATCH_LINKS = None
+DEFAULT_CAPTURE_PROFILE = 'full'
+DEFAULT_CAPTURE_BOTTLENECK = False
+DEFAULT_LIVE_VIEW = False
+DEFAULT_FTRACE_FILTER = True
+# keep every tcp_probe event
+DEFAULT_FTRACE_SAMPLE = 1
+DEFAULT_RAW_FTRACE = False
+DEFAULT_CPROFILE = False
+DEFAULT_COUNT_WRITTEN = False
+DEFAULT_FTRACE_STRICT = False
+# None writes raw artifacts uncompressed, otherwise a utils.COMPRESSION_SUFFIXES
+# key
+DEFAULT_COMPRESSION = None
+DEFAULT_PIPELINE = False
 
+# Script a run is handed to for post-processing by an AnalysisPipeline, the
+# niceness it runs at, and the file in the run's directory its output is saved
+# to
+ANALYSIS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis.py")
+ANALYSIS_NICENESS = 10
+ANALYSIS_LOG_NAME = "analysis.log"
+# Runs an AnalysisPipeline analyzes at once
+ANALYSIS_PIPELINE_DEPTH = 1
+
+# Smallest per cpu ftrace buffer size in kB, used when the run's tcp_probe
+# events are estimated to need less, see ftraceBufferSize
 FTRACE_BUFFER_SIZE = 5632
 
+# Seconds given to the iperf3 servers to start listening before any flow starts
+IPERF_SERVER_STARTUP = 0.5
+# Seconds an iperf3 flow may run past its runtime before it is killed
+IPERF_TIMEOUT_MARGIN = 60
+
 VALID_ALGS = {
   'reno': True,
   'bbr': True,
@@ -40,27 +84,48 @@ class HostPair:
   result_dir = ""
   client_host = None
   server_host = None
+  c_port = DEFAULT_C_PORT
+  s_port = DEFAULT_S_PORT
   ping_proc = None
+  # writes ping's output through a compressor, see startPinging
+  ping_compressor = None
+  server_proc = None
   last_iperf_results = ""
+  iperf_json = False
   delay = 0
+  # seconds from the run's start instant to when the flow actually started,
+  # None until the flow is run by runIperfFlow
+  start_offset = None
+  # seconds from the run's start instant to when the flow's iperf3 client
+  # exited, None until the flow is run by runIperfFlow
+  end_offset = None
   
-  # Constructor: Requires the host that is sending data and the host that is receiving data
-  def __init__(self, client_host, server_host):
+  # Constructor: Requires the host that is sending data and the host that is
+  # receiving data, and the iperf3 client and server ports of their flow
+  def __init__(self, client_host, server_host, c_port=DEFAULT_C_PORT, s_port=DEFAULT_S_PORT):
     self.client_host = client_host
     self.server_host = server_host
+    self.c_port = c_port
+    self.s_port = s_port
     self.result_dir = f"{client_host.name}_{server_host.name}/"
   
-  # Starts ping to server_host from client_host if we are not pinging already
-  def startPinging(self, base_path):
+  # Starts ping to server_host from client_host if we are not pinging already.
+  # If codec is given ping's output is written through that compressor, see
+  # utils.openArtifact
+  def startPinging(self, base_path, codec=None):
     if not self.ping_proc == None:
       self.endPinging()
 
     self.checkDir(base_path)
+    path = f"{base_path}{self.result_dir}ping.txt"
     self.ping_proc = startPing(
       self.client_host, 
       self.server_host.IP(), 
-      f"{base_path}{self.result_dir}ping.txt"
+      path if codec is None else None
     )
+    if codec is not None:
+      self.ping_compressor = StreamCompressor(self.ping_proc.stdout, path, codec)
+      self.ping_compressor.start()
 
   # Creates the result_dir if it does not exist already.
   # base_path is the path to the directory that will contain result_dir.
@@ -69,86 +134,206 @@ class HostPair:
     if not os.path.exists(base_path + self.result_dir):
       os.makedirs(complete_path)
   
-  # Sends SIGINT to a running ping_proc  
+  # Sends SIGINT to a running ping_proc, and waits for the rest of its output
+  # to be written
   def endPinging(self):
     if not self.ping_proc == None:
       self.ping_proc.send_signal(signal.SIGINT)
       self.ping_proc.wait()
+    if not self.ping_compressor == None:
+      self.ping_compressor.stop()
+      self.ping_compressor = None
 
   def getClient(self):
     return self.client_host
 
-  # Starts iperf3 server on self.server_host using port s_port, then starts
-  # flow from self.client_host for runtime seconds from client using c_port. If
-  # delay is specified, will sleep for delay seconds before starting flow. 
+  # Starts iperf3 server on self.server_host using port self.s_port, to be used
+  # by a later runIperfFlow
+  def startIperfServer(self):
+    self.server_proc = startIperfServer(self.server_host, self.s_port)
+
+  # Sends SIGINT to a running server_proc
+  def endIperfServer(self):
+    if not self.server_proc == None:
+      self.server_proc.send_signal(signal.SIGINT)
+      self.server_proc.wait()
+      self.server_proc = None
+
+  # Coroutine that starts a flow from self.client_host for runtime seconds from
+  # client using self.c_port, at self.delay seconds after time_origin, a
+  # time.monotonic() instant. The server must already be started by
+  # startIperfServer. Records the actual start time of the flow, relative to
+  # time_origin, as self.start_offset, and its end as self.end_offset.
+  # iperf_json and iperf_interval are passed to utils function startIperfClientProc
   # Returns iperf3 output as string
-  def startIperfFlow(self, c_port, s_port, runtime, delay=0):
-    server_proc = startIperfServer(self.server_host, s_port)
-    self.delay = delay
-    if delay > 0:
-      time.sleep(delay) 
-    self.last_iperf_results = startIperfClient(self.client_host, c_port, self.server_host.IP(), s_port, runtime)
-    server_proc.send_signal(signal.SIGINT)
-    server_proc.wait()
+  async def runIperfFlow(self, runtime, time_origin, iperf_json=False, iperf_interval=None):
+    self.iperf_json = iperf_json
+    await asyncio.sleep(max(0, time_origin + self.delay - time.monotonic()))
+
+    proc = startIperfClientProc(self.client_host, self.c_port, self.server_host.IP(), self.s_port, runtime, iperf_json, iperf_interval)
+    self.start_offset = time.monotonic() - time_origin
+    self.last_iperf_results = await readProcOutput(proc, int(runtime) + IPERF_TIMEOUT_MARGIN)
+    self.end_offset = time.monotonic() - time_origin
 
     return self.last_iperf_results
+
+  # Returns the seconds from the run's start instant to when the flow started,
+  # the nominal delay if the actual start was not recorded
+  def getStartOffset(self):
+    return self.delay if self.start_offset is None else self.start_offset
   
-  # Writes the last iperf3 result to disk
-  def saveIperfResults(self, base_path):
+  # Writes the last iperf3 result to disk, as iperf.json if it was reported in
+  # JSON or iperf.txt otherwise, through compressor codec if given
+  def saveIperfResults(self, base_path, codec=None):
     checkDir(base_path)
-    saveIperfLogs(self.last_iperf_results, f"{base_path}{self.result_dir}iperf.txt")
+    saveIperfLogs(self.last_iperf_results, f"{base_path}{self.result_dir}{self.getIperfLogName()}", codec)
+
+  def getIperfLogName(self):
+    return "iperf.json" if self.iperf_json else "iperf.txt"
 
   def getLastIperfResults(self):
     return self.last_iperf_results
   
-  # Calls utils function to parse ftrace file located at ftrace_path using client
-  # port: c_port and server port: s_port. If the last iperf3 flow had a delay
-  # updates the time values accordingly.
-  # Returns the parsed information as as pandas dataframe
-  #
-  # TODO should refactor to store ports as part of class instead of being passed in
-  # TODO have utils function update time values instead?
-  def parseFtrace(self, ftrace_path, c_port, s_port):
-    ftrace_df = parseFtraceCWND(ftrace_path, self.client_host.IP(), c_port, self.server_host.IP(), s_port)
-    ftrace_df['Time'] = [time + self.delay for time in ftrace_df['Time']]
-
-    self.ftrace = ftrace_df
-    return self.ftrace
-
-  # Calls utils function to parse ping results located in directory base_path
-  # into pandas dataframe.
-  # Returns results as pandas dataframe
-  def parsePings(self, base_path):
-    self.rtt = getRTTs(f"{base_path}{self.result_dir}ping.txt")
-    return self.rtt
-  
-  # Calls utils function to export ping dataframe to csv in result_dir
-  def exportCSVPing(self, base_path):
-    dfExportCSV(self.rtt, f"{base_path}{self.result_dir}ping.csv")
-
-  # Calls utils function to export ftrace dataframe to csv in result_dir
-  def exportCSVFtrace(self, base_path):
-    dfExportCSV(self.ftrace, f"{base_path}{self.result_dir}ftrace.csv")
-
-  # Plots ping and ftrace data as a new figure. Saves resulting figure as .png
-  # in result_dir
-  def plotGraphs(self, plt, base_path):
-    fig, (ax1, ax2) = plt.subplots(2)
-
-    ax1.plot(self.rtt['Time'], self.rtt['RTT'])
-    ax1.set_title("RTT")
-    ax1.set_xlabel("Time (s)")
-    ax1.set_ylabel("Round-Trip Time (ms)")
-
-    ax2.plot(self.ftrace['Time'], self.ftrace['CWND'])
-    ax2.set_title("CWND")
-    ax2.set_xlabel("Time (s)")
-    ax2.set_ylabel("Window Size (segments)")
-
-    fig.suptitle(f"CWND and RTT for {self.client_host.name}-{self.server_host.name} flow") 
-    plt.tight_layout()
-    plt.savefig(f"{base_path}{self.result_dir}graph.png")
-    return plt
+  # Returns a dict describing this host pair's flow, used for post-processing
+  # and the run manifest. alg is the congestion algorithm of the client host
+  def describe(self, alg=None):
+    return {
+      'result_dir': self.result_dir,
+      'client': self.client_host.name,
+      'server': self.server_host.name,
+      'client_ip': self.client_host.IP(),
+      'server_ip': self.server_host.IP(),
+      'c_port': self.c_port,
+      's_port': self.s_port,
+      'delay': self.delay,
+      'start_offset': self.getStartOffset(),
+      'alg': alg,
+      'iperf_log': self.getIperfLogName()
+    }
+
+# AnalysisPipeline Class
+# Post-processes finished runs in background analysis.py processes, so the
+# next run can be captured while earlier ones are parsed, exported and
+# plotted. Each worker is a new interpreter that loads matplotlib and the
+# parsed results itself, running at a lower priority so it does not take cpu
+# time from the emulation. At most depth runs are analyzed at once, handing
+# over another waits for the oldest to finish, so analysis can not fall ever
+# further behind the captures.
+class AnalysisPipeline:
+  def __init__(self, depth=ANALYSIS_PIPELINE_DEPTH):
+    self.depth = depth
+    # (output_dir, process) of each run being analyzed, oldest first
+    self.pending = []
+    self.finished = []
+
+  # Starts analyzing the run saved in output_dir with analysis.py, passing it
+  # args, once fewer than depth runs are being analyzed
+  def submit(self, output_dir, args):
+    while len(self.pending) >= self.depth:
+      self._reap(self.pending[0])
+
+    with open(output_dir + ANALYSIS_LOG_NAME, 'w') as log:
+      # niced by nice(1) rather than in a preexec_fn, which is not safe to run
+      # while the ftrace streamer threads are running
+      proc = subprocess.Popen(
+        ['nice', '-n', str(ANALYSIS_NICENESS),
+         sys.executable, ANALYSIS_SCRIPT, output_dir] + args,
+        stdin=subprocess.DEVNULL,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+        # the worker is not sent the terminal's ^C, and outlives the capture
+        start_new_session=True
+      )
+    self.pending.append((output_dir, proc))
+
+  # Returns the output directories of the runs analyzed successfully since the
+  # last call, oldest first. Runs whose analysis failed are reported and left
+  # out. If wait is True, every pending run is waited for first
+  def collect(self, wait=False):
+    for entry in list(self.pending):
+      if wait or entry[1].poll() is not None:
+        self._reap(entry)
+
+    finished, self.finished = self.finished, []
+    return finished
+
+  def _reap(self, entry):
+    output_dir, proc = entry
+    proc.wait()
+    self.pending.remove(entry)
+    if proc.returncode == 0:
+      self.finished.append(output_dir)
+    else:
+      print(f"\nAnalysis of {output_dir} failed, see {output_dir}{ANALYSIS_LOG_NAME}. Run analysis.py on it again once fixed")
+
+# Coroutine that runs the iperf3 flow of every host pair in host_pairs
+# concurrently on one event loop, each starting its host pair's delay after
+# time_origin. See HostPair.runIperfFlow for the remaining arguments
+async def runFlows(host_pairs, runtime, time_origin, iperf_json=False, iperf_interval=None):
+  await asyncio.gather(*[
+    host_pair.runIperfFlow(runtime, time_origin, iperf_json, iperf_interval) for host_pair in host_pairs
+  ])
+
+# Gives host pair i of a run its iperf3 ports, counting up from the run's
+# c_port and s_port so every flow can be told apart in the trace.
+# Returns the client and server port as strings
+def allocatePorts(c_port, s_port, i):
+  return str(int(c_port) + i), str(int(s_port) + i)
+
+# Starts the packet captures of a run on net, built from topo, using the
+# utils.CAPTURE_PROFILES key capture_profile. Captures once per host in
+# host_clients or, if capture_bottleneck is True, once on the left switch's
+# end of the bottleneck link, which sees every flow in both directions.
+# Returns the tcpdump processes and the names of their capture files in
+# output_dir
+def startCaptures(net, topo, host_clients, host_pairs, output_dir, capture_profile, capture_bottleneck):
+  profile = CAPTURE_PROFILES[capture_profile]
+  bpf_filter = None
+  if profile['filter_ports']:
+    bpf_filter = tcpPortFilter(
+      [host_pair.c_port for host_pair in host_pairs] + [host_pair.s_port for host_pair in host_pairs]
+    )
+
+  captures = []
+  if capture_bottleneck:
+    l_switch, r_switch = [net.get(name) for name in topo.getBottleneckNames()]
+    link = net.linksBetween(l_switch, r_switch)[0]
+    intf = link.intf1 if link.intf1.node == l_switch else link.intf2
+    captures.append((l_switch, intf.name, "bottleneck_tcpdump.pcap"))
+  else:
+    captures += [(client, None, f"{client.name}_tcpdump.pcap") for client in host_clients]
+
+  dump_procs = [
+    startTCPdump(node, output_dir + name, profile['snaplen'], bpf_filter, profile['file_size'], profile['file_count'], intf_name)
+    for node, intf_name, name in captures
+  ]
+
+  return dump_procs, [name for node, intf_name, name in captures]
+
+# Sizes the per cpu ftrace buffer for a run of num_host_pairs flows over the
+# links of link_config, a dumbbell.LINK_CONFIG entry, lasting runtime seconds
+# after the largest of delays. A streamed trace only has to hold the events
+# of FTRACE_STREAM_HEADROOM seconds, an unstreamed one those of the whole run.
+# sample and event_size are passed to utils.estimateFtraceBuffer.
+# Returns the size to use and the estimated size needed, both in kB. Sizes are
+# capped by utils.maxFtraceBuffer, and the estimate is None if link_config has
+# no bandwidths
+def ftraceBufferSize(link_config, num_host_pairs, runtime, delays, streamed, sample=1, event_size=TCP_PROBE_EVENT_SIZE):
+  if link_config is None or not all('bw' in config for config in link_config):
+    return FTRACE_BUFFER_SIZE, None
+
+  # flows are limited by the bottleneck, or by their own links if those add
+  # up to less
+  rate = min(link_config[1]['bw'], num_host_pairs * min(link_config[0]['bw'], link_config[2]['bw']))
+  seconds = FTRACE_STREAM_HEADROOM if streamed else int(runtime) + max(delays, default=0) + IPERF_SERVER_STARTUP
+  estimate = estimateFtraceBuffer(rate, seconds, event_size, sample)
+
+  size = max(FTRACE_BUFFER_SIZE, estimate)
+  max_size = maxFtraceBuffer()
+  if max_size is not None:
+    size = max(FTRACE_BUFFER_SIZE, min(size, max_size))
+
+  return size, estimate
 
 # Creates a descriptive name for the base output directory that results are
 # saved to. Name is based on congestion algorithm list algs, and the link
@@ -177,27 +362,83 @@ def genDescription(algs, config_name):
 # config_name: name of link configuration defined in Dumbbell class
 # delays: list of floating point numbers representing a delay before starting a
 #         clients iperf3 flow. 
-def testDriver(topo, algs=DEFAULT_ALGS, runtime=DEFAULT_RUNTIME, config_name=DEFAULT_LINK_CONFIG, delays=DEFAULT_DELAYS):
-  dump_procs = []
-  threads = []
-  net = Mininet(topo)
+# stream_ftrace: if True, trace_pipe is drained to disk while the flows run
+#                instead of reading the ftrace buffer once all flows finish
+# export_format: format parsed results are exported in, a key of
+#                utils.EXPORT_FORMATS
+# workers: number of processes used to post-process host pair results
+# net: already started Mininet network built from topo. If given, it is reused
+#      and left running for the caller to stop, otherwise a new network is
+#      started and stopped by this run
+# ftrace_instance: if True, tcp_probe is traced into a private ftrace instance
+#                  named after the run instead of the global ftrace buffer, so
+#                  other experiments can trace at the same time
+# c_port, s_port: iperf3 client and server ports of the first host pair, each
+#                 following host pair uses the next ports up. Experiments
+#                 running at the same time should use port ranges that do not
+#                 overlap so their flows can be told apart
+# iperf_json: if True, iperf3 reports in JSON, which is parsed into a per
+#             interval throughput/retransmit dataframe for each host pair
+# iperf_interval: seconds between iperf3 reports, may be below 1
+# capture_profile: key of utils.CAPTURE_PROFILES used by tcpdump
+# capture_bottleneck: if True, packets are captured once on the bottleneck link
+#                     instead of on every client host
+# live_view: if True, each flow's CWND and RTT are drawn in the terminal while
+#            the flows run. Implies stream_ftrace, as the view follows the
+#            streamed trace
+# ftrace_filter: if True, tcp_probe only records the sockets of the run's
+#                iperf3 clients, filtered in the kernel before events reach
+#                the buffer
+# ftrace_sample: power of two N, if above 1 the filtered tcp_probe events are
+#                thinned to roughly 1 in N by acknowledged sequence number,
+#                which is biased against loss recovery. See
+#                utils.tcpProbeFilter
+# raw_ftrace: if True, the binary per cpu ring buffers are drained to disk
+#             while the flows run and decoded afterwards, instead of having
+#             the kernel format every event as text. Replaces stream_ftrace,
+#             and can not be used with live_view, which follows the text trace
+# ftrace_strict: if True, TraceLossError is raised once the run's results are
+#                saved if tcp_probe events were lost or any flow's CWND series
+#                is incomplete. Otherwise a warning is printed
+# cprofile: if True, post-processing is profiled with cProfile, including in
+#           every worker, and the statistics saved to utils.CPROFILE_NAME. The
+#           duration and peak RSS of each phase of the run are always saved
+#           to utils.PROFILE_NAME
+# count_written: if True, the bytes written of each phase are saved with it,
+#                walking the output directory at every phase boundary
+# compression: if given, a utils.COMPRESSION_SUFFIXES key. The trace, ping and
+#              iperf3 output are written through that compressor as they are
+#              saved, and packet captures are compressed once tcpdump stops.
+#              Every parser decompresses them as it reads. Can not be used
+#              with live_view, which follows the uncompressed files
+# pipeline: if given, an AnalysisPipeline the run is handed to once its
+#           network is stopped, instead of being parsed, exported and plotted
+#           before returning. Only lost events are known on return, so with
+#           ftrace_strict incomplete CWND series do not raise TraceLossError
+#           and are only recorded in the manifest
+#
+# Returns the output directory the run's results were saved to
+def testDriver(topo, algs=DEFAULT_ALGS, runtime=DEFAULT_RUNTIME, config_name=DEFAULT_LINK_CONFIG, delays=DEFAULT_DELAYS, stream_ftrace=DEFAULT_STREAM_FTRACE, export_format=DEFAULT_EXPORT_FORMAT, workers=DEFAULT_WORKERS, net=None, ftrace_instance=DEFAULT_FTRACE_INSTANCE, c_port=DEFAULT_C_PORT, s_port=DEFAULT_S_PORT, iperf_json=DEFAULT_IPERF_JSON, iperf_interval=DEFAULT_IPERF_INTERVAL, capture_profile=DEFAULT_CAPTURE_PROFILE, capture_bottleneck=DEFAULT_CAPTURE_BOTTLENECK, live_view=DEFAULT_LIVE_VIEW, ftrace_filter=DEFAULT_FTRACE_FILTER, ftrace_sample=DEFAULT_FTRACE_SAMPLE, raw_ftrace=DEFAULT_RAW_FTRACE, cprofile=DEFAULT_CPROFILE, ftrace_strict=DEFAULT_FTRACE_STRICT, compression=DEFAULT_COMPRESSION, pipeline=None, count_written=DEFAULT_COUNT_WRITTEN):
+  owns_net = net is None
+  stream_ftrace = stream_ftrace or live_view
   
   time_secs = int(time.time())
+  profiler = RunProfiler(cprofile=cprofile, count_written=count_written)
 
-  c_port = '5201'
-  s_port = '5001'
+  if owns_net:
+    profiler.start('network_setup')
+    net = startNetwork(topo)
+    print(f"\nNetwork set up in {topo.setup_time:.2f} seconds")
 
-  net.start()
-
-  prev_buffer_size = setFtraceBuffer(FTRACE_BUFFER_SIZE)
-  
   print("\nUsing the following node connections: ")
   # Mininet function, prints node connections
   dumpNetConnections(net)
   # get names of source and destination hosts that will be creating tcp flows
   host_pair_names = topo.getNodePairNames()
   # Build host pairs using Mininet function with host names
-  host_pairs = [HostPair(net.get(h_c), net.get(h_s)) for (h_c, h_s) in host_pair_names]
+  host_pairs = [
+    HostPair(net.get(h_c), net.get(h_s), *allocatePorts(c_port, s_port, i)) for i, (h_c, h_s) in enumerate(host_pair_names)
+  ]
 
   #TODO implement bandwidth test via user argument
   #testBWD(net, [host_pairs[0].client_host, host_pairs[0].server_host])
@@ -210,87 +451,308 @@ def testDriver(topo, algs=DEFAULT_ALGS, runtime=DEFAULT_RUNTIME, config_name=DEF
   # will be stored
   description = genDescription(algs, config_name)
   output_dir = createOutputDir(description)
+  profiler.output_dir = output_dir
 
-  # ensure ftrace buffer is not being written to and then clear it
-  endFtrace()
-  clearFtrace()
+  profiler.start('trace_setup')
 
-  delay_idx = 0
-  for host_pair in host_pairs:
-    # start ping between host pair
-    host_pair.startPinging(output_dir)
+  # trace into the global buffer, or a private instance named after the run's
+  # output directory, which is unique
+  ftrace_dir = FTRACE_PATH
+  if ftrace_instance:
+    ftrace_dir = createFtraceInstance(os.path.basename(os.path.normpath(output_dir)))
 
-    # set delay if delay specified for host pair
-    delay = 0
-    if delay_idx < len(delays):
-      delay = delays[delay_idx]
-    
-    # append a new thread to our thread list that will call startIperfFlow and 
-    # saveIperfResults when executed
-    threads.append(threading.Thread(
-      target=lambda host_pair=host_pair, delay=delay:(host_pair.startIperfFlow(c_port, s_port, runtime, delay), 
-      host_pair.saveIperfResults(output_dir))
-    ))
-    delay_idx += 1
-  
-  alg_idx = 0
-  for client in host_clients:
-    # start tcpdump on source host
-    dump_procs.append(startTCPdump(client, f"{output_dir}{client.name}_tcpdump.pcap"))
+  # size the buffer for the events the flows will produce, sampling being part
+  # of the kernel filter
+  buffer_size, buffer_estimate = ftraceBufferSize(
+    lc.get(config_name),
+    len(host_pairs),
+    runtime,
+    delays,
+    stream_ftrace or raw_ftrace,
+    ftrace_sample if ftrace_filter else 1,
+    tcpProbeEventSize(ftrace_dir)
+  )
+  if buffer_estimate is not None and buffer_estimate > buffer_size:
+    print(f"\nWARNING: tcp_probe events are estimated to need a {buffer_estimate} kB ftrace buffer per cpu, but only {buffer_size} kB fits in memory. Events will likely be lost, stream the trace (-s or -r) or sample it (-S)")
+  # state changed below, put back in the finally block however the run ends
+  prev_buffer_size = None
+  prev_clock = None
+  probe_filter = None
+  ftrace_streamer = None
+  live_monitor = None
+  try:
+    prev_buffer_size = setFtraceBuffer(buffer_size, ftrace_dir)
+    # timestamp events with the monotonic clock so they line up with ping's
+    prev_clock = setFtraceClock(FTRACE_CLOCK, ftrace_dir)
+    clock_offset = getClockOffset()
+
+    # ensure ftrace buffer is not being written to and then clear it
+    endFtrace(ftrace_dir)
+    clearFtrace(ftrace_dir)
+
+    profiler.start('capture_start')
+    delay_idx = 0
+    for host_pair in host_pairs:
+      # start ping between host pair
+      host_pair.startPinging(output_dir, compression)
+
+      # set delay if delay specified for host pair
+      host_pair.delay = 0
+      if delay_idx < len(delays):
+        host_pair.delay = delays[delay_idx]
     
-    # set congestion algorithm if specified for host pair
-    if alg_idx < len(algs):
-      print(f"\nApplying specified congestion algorithm to host {client.name}...")
-      print(setCongAlg(client, algs[alg_idx]))
-      alg_idx += 1
+      delay_idx += 1
   
-  # enable writing to ftrace buffer by kernel
-  startFtrace()
+    # start tcpdump on source hosts or the bottleneck
+    dump_procs, captures = startCaptures(net, topo, host_clients, host_pairs, output_dir, capture_profile, capture_bottleneck)
 
-  print("\n**********Starting RTT test with iperf3 (" + runtime + " seconds)**************")
-  # execute all threads
-  for thread in threads:
-    thread.start()
+    profiler.start('congestion_algs')
+    # congestion algorithm set on each client host, by host name
+    client_algs = {}
+    alg_idx = 0
+    for client in host_clients:
+      # set congestion algorithm if specified for host pair
+      if alg_idx < len(algs):
+        print(f"\nApplying specified congestion algorithm to host {client.name}...")
+        print(setCongAlg(client, algs[alg_idx]))
+        client_algs[client.name] = algs[alg_idx]
+        alg_idx += 1
   
-  # wait for threads to finish executing
-  for thread in threads:
-    thread.join()
+    profiler.start('trace_start')
+    # a directory of per cpu ring buffer pages when tracing raw, a text file
+    # otherwise. parseFtraceFlows reads either
+    ftrace_name = 'ftrace_raw/' if raw_ftrace else 'ftrace_raw.txt'
+    ftrace_path = output_dir + ftrace_name
+
+    # start draining the ring buffers or trace_pipe to disk before events are
+    # produced
+    if raw_ftrace:
+      ftrace_streamer = RawFtraceStreamer(ftrace_path, ftrace_dir, compression)
+      ftrace_streamer.start()
+    elif stream_ftrace:
+      ftrace_streamer = FtraceStreamer(ftrace_path, ftrace_dir, compression)
+      ftrace_streamer.start()
+
+    # record only the run's flows, dropping other sockets' events in the kernel
+    if ftrace_filter:
+      probe_filter = tcpProbeFilter(
+        [host_pair.c_port for host_pair in host_pairs], [host_pair.s_port for host_pair in host_pairs], ftrace_sample
+      )
+      try:
+        setFtraceFilter(probe_filter, ftrace_dir)
+      except OSError as e:
+        print(f"\nCould not filter tcp_probe events, tracing every socket: {e}")
+        probe_filter = None
+
+    if live_view:
+      live_monitor = LiveMonitor(ftrace_path, [{
+        'name': f"{host_pair.client_host.name}-{host_pair.server_host.name}",
+        'key': (f"{host_pair.client_host.IP()}:{host_pair.c_port}", f"{host_pair.server_host.IP()}:{host_pair.s_port}"),
+        'ping': f"{output_dir}{host_pair.result_dir}ping.txt"
+      } for host_pair in host_pairs], clock_offset)
+      live_monitor.start()
+
+    # enable writing to ftrace buffer by kernel
+    startFtrace(ftrace_dir)
+
+    # start every iperf3 server up front, so server start up is not added to any
+    # flow's delay
+    profiler.start('iperf_servers')
+    for host_pair in host_pairs:
+      host_pair.startIperfServer()
+    time.sleep(IPERF_SERVER_STARTUP)
+
+    print("\n**********Starting RTT test with iperf3 (" + runtime + " seconds)**************")
+    # all ftrace and ping times are measured from when the flows are started
+    profiler.start('flows')
+    time_origin = time.monotonic()
+    asyncio.run(runFlows(host_pairs, runtime, time_origin, iperf_json, iperf_interval))
 
-  print("\nSample result:\n", host_pairs[0].getLastIperfResults())
+    profiler.start('capture_end')
+    if live_monitor is not None:
+      live_monitor.stop()
+
+    for host_pair in host_pairs:
+      host_pair.endIperfServer()
+      host_pair.saveIperfResults(output_dir, compression)
+
+    print("\nSample result:\n", host_pairs[0].getLastIperfResults())
   
-  endFtrace()
+    endFtrace(ftrace_dir)
 
-  # end tcpdump processes
-  for dump_proc in dump_procs:
-    dump_proc.send_signal(signal.SIGINT)
-    dump_proc.wait()
+    # end tcpdump processes
+    for dump_proc in dump_procs:
+      dump_proc.send_signal(signal.SIGINT)
+      dump_proc.wait()
 
-  for host_pair in host_pairs:
-    host_pair.endPinging()
+    for host_pair in host_pairs:
+      host_pair.endPinging()
+
+    # tcpdump can only write uncompressed files, so compress them once it stops
+    if compression is not None:
+      profiler.start('capture_compress')
+      for capture in captures:
+        for path in pcapFiles(output_dir + capture):
+          compressFile(path, compression)
   
-  # save full ftrace buffer to file
-  ftrace_content = getFtraceLogs()
-  ftrace_path = output_dir + 'ftrace_raw.txt'
-  saveFtrace(ftrace_content, ftrace_path)
-
-  # save host pair experiment results to file
-  for host_pair in host_pairs:
-    cwnd_data = host_pair.parseFtrace(ftrace_path, c_port, s_port)
-    rtt_data = host_pair.parsePings(output_dir)
-    host_pair.exportCSVPing(output_dir)
-    host_pair.exportCSVFtrace(output_dir)
-    host_pair.plotGraphs(plt, output_dir)
-
-  # show host pair generated graphs
-  plt.show()
-
-  # Teardown controllers, switches and hosts. If we crash before tearing down, 
-  # mininet will not be able to run. Run "sudo mn" before restarting the program
-  # to fix this
-  # TODO see if we can automate this at beginning of run
-  net.stop()
-  setFtraceBuffer(prev_buffer_size)
-  print("\n\nResults saved to the following location: " + output_dir)
+    profiler.start('ftrace_save')
+    if ftrace_streamer is not None:
+      # write out whatever is left in the ring buffers or trace_pipe
+      ftrace_streamer.stop()
+    else:
+      # save full ftrace buffer to file
+      ftrace_content = getFtraceLogs(ftrace_dir)
+      saveFtrace(ftrace_content, ftrace_path, compression)
+
+    # events overwritten or dropped by the ring buffer, read before the buffer
+    # is resized or removed
+    ftrace_loss = getFtraceLoss(ftrace_dir)
+
+    profiler.start('network_stop')
+    # describe each host pair's flow while its hosts still exist
+    flows = [host_pair.describe(client_algs.get(host_pair.getClient().name)) for host_pair in host_pairs]
+  finally:
+    # a failed run, or ^C, must not leave tcp_probe enabled, a buffer sized
+    # for the run or a private instance behind. Stopping is a no op for what
+    # the run already stopped
+    if live_monitor is not None:
+      live_monitor.stop()
+    endFtrace(ftrace_dir)
+    if ftrace_streamer is not None:
+      ftrace_streamer.stop()
+
+    # Teardown controllers, switches and hosts. Everything post-processing
+    # needs is on disk by now, so do this before post-processing in case it
+    # fails. If we crash before tearing down, mininet will not be able to
+    # run. Run "sudo mn" before restarting the program to fix this
+    # TODO see if we can automate this at beginning of run
+    if owns_net:
+      net.stop()
+
+    # a private instance is removed along with its buffer, so there is no
+    # buffer size to restore
+    if ftrace_instance:
+      removeFtraceInstance(ftrace_dir)
+    else:
+      if prev_buffer_size is not None:
+        setFtraceBuffer(prev_buffer_size, ftrace_dir)
+      if prev_clock is not None:
+        setFtraceClock(prev_clock, ftrace_dir)
+      if probe_filter is not None:
+        setFtraceFilter("0", ftrace_dir)
+
+  # seconds taken to create and start the network, and those spent on each
+  # host pair's own links, None if it was started by the caller without
+  # dumbbell.startNetwork
+  setup_time = getattr(topo, 'setup_time', None)
+  pair_setup_times = getattr(topo, 'pair_setup_times', None)
+
+  # each host pair's share of the flows phase, as timed by runIperfFlow
+  for host_pair, flow in zip(host_pairs, flows):
+    if host_pair.end_offset is not None:
+      profiler.add(
+        f"{flow['client']}-{flow['server']}",
+        'flow',
+        time_origin + host_pair.start_offset,
+        host_pair.end_offset - host_pair.start_offset,
+        dirSize(output_dir + host_pair.result_dir) if count_written else None
+      )
+
+  # describe the run so its results can be reloaded with utils.loadRun. What
+  # is found parsing the trace, and each flow's exported files, are added once
+  # it is analyzed
+  manifest = {
+    'description': description,
+    'start_time': time_secs,
+    'runtime': int(runtime),
+    'link_config_name': config_name,
+    'link_config': lc.get(config_name),
+    'num_host_pairs': len(host_pairs),
+    'setup_time': setup_time,
+    'setup_time_per_pair': pair_setup_times,
+    'algs': algs,
+    'delays': delays,
+    'stream_ftrace': stream_ftrace,
+    'raw_ftrace': raw_ftrace,
+    'profile': PROFILE_NAME,
+    'cprofile': None,
+    # compressor raw artifacts were written through, their names here and in
+    # flows being those without its suffix
+    'compression': compression,
+    # True if the run was analyzed by a background worker, see AnalysisPipeline
+    'pipelined': pipeline is not None,
+    'ftrace_instance': ftrace_instance,
+    'iperf_json': iperf_json,
+    'iperf_interval': iperf_interval,
+    'export_format': export_format,
+    'capture_profile': capture_profile,
+    'capture_bottleneck': capture_bottleneck,
+    # packet capture files, each a ring of files named after it if the capture
+    # profile rotates files
+    'captures': captures,
+    'ftrace': ftrace_name,
+    'ftrace_filter': probe_filter,
+    'ftrace_sample': ftrace_sample,
+    'ftrace_buffer_kb': buffer_size,
+    'ftrace_buffer_estimate_kb': buffer_estimate,
+    'ftrace_loss': ftrace_loss,
+    'incomplete_flows': None,
+    'trace_clock': FTRACE_CLOCK,
+    'time_origin': time_origin,
+    'clock_offset': clock_offset,
+    'flows': flows
+  }
+
+  if pipeline is not None:
+    # everything analysis.py needs is on disk, so hand the run over and
+    # return for the next run to start
+    saveManifest(manifest, output_dir)
+    profiler.save(output_dir + PROFILE_NAME)
+    args = ['-n', '-p', '-f', export_format]
+    if workers is not None:
+      args += ['-w', str(workers)]
+    if cprofile:
+      args.append('-P')
+    if count_written:
+      args.append('-W')
+    pipeline.submit(output_dir, args)
+
+    trace_warning = traceWarning(ftrace_loss)
+    print(f"\n\nRun handed to background analysis, results will be saved to the following location: {output_dir}")
+  else:
+    from analysis import analyzeRun
+
+    profiler.startCProfile()
+    # read the ftrace file once, splitting it into per flow dataframes
+    profiler.start('ftrace_parse')
+    ftrace_flows = parseFtraceFlows(ftrace_path, time_origin)
+
+    # events are only sampled if the kernel filter could be set
+    manifest['incomplete_flows'] = findIncompleteFlows(flows, ftrace_flows, ftrace_sample if probe_filter is not None else 1)
+    trace_warning = traceWarning(ftrace_loss, manifest['incomplete_flows'])
+
+    # read each packet capture once, splitting it into per flow dataframes
+    profiler.start('pcap_parse')
+    pcap_flows = {}
+    for capture in captures:
+      pcap_flows.update(parsePcapFlows(pcapFiles(output_dir + capture), time_origin, clock_offset))
+
+    # parse, export and plot host pair experiment results in parallel
+    profiler.start('analysis')
+    manifest['flows'] = analyzeRun(output_dir, flows, ftrace_flows, export_format, workers, time_origin, clock_offset, pcap_flows, profiler=profiler)
+    profiler.stop()
+    if profiler.saveCProfile(output_dir + CPROFILE_NAME) is not None:
+      manifest['cprofile'] = CPROFILE_NAME
+
+    saveManifest(manifest, output_dir)
+    profiler.save(output_dir + PROFILE_NAME)
+
+    print("\n\nResults saved to the following location: " + output_dir)
+
+  if ftrace_strict and trace_warning is not None:
+    raise TraceLossError(f"Run {output_dir} is incomplete: {trace_warning}", output_dir)
+
+  return output_dir
   
 
 class ArgumentError(Exception):
@@ -298,6 +760,14 @@ class ArgumentError(Exception):
     self.message = message
     super().__init__(message)
 
+# Raised by testDriver when tcp_probe events of a run were lost. output_dir is
+# the directory the run's results were saved to
+class TraceLossError(Exception):
+  def __init__(self, message, output_dir=None):
+    self.message = message
+    self.output_dir = output_dir
+    super().__init__(message)
+
 # Verifies argument has been passed in with specified option
 def optionHasArg(index, args, option):
   no_arg_msg = " flag specified but no argument found. Using default setting. Use -h for more information"
@@ -323,6 +793,19 @@ def validateAlgs(algs):
 
   return True
 
+# Verifies that ports are integers in the range of usable port numbers, along
+# with the num_host_pairs - 1 ports allocated after each of them
+def validatePorts(ports, num_host_pairs=1):
+  for port in ports:
+    if not isInt(port) or not 0 < int(port) or not int(port) + num_host_pairs - 1 < 65536:
+      return False
+
+  return True
+
+# Verifies that a tcp_probe sampling rate is a power of two
+def validateSample(sample):
+  return isInt(sample) and int(sample) > 0 and int(sample) & (int(sample) - 1) == 0
+
 # Verifies that delays are not negative
 def validateDelays(delays):
   for delay in delays:
@@ -343,7 +826,27 @@ def argParser(args):
     'num_host_pairs': DEFAULT_NUM_HOST_PAIRS,
     'algs': DEFAULT_ALGS,
     'lc_name': DEFAULT_LINK_CONFIG,
-    'delays': DEFAULT_DELAYS
+    'delays': DEFAULT_DELAYS,
+    'stream_ftrace': DEFAULT_STREAM_FTRACE,
+    'export_format': DEFAULT_EXPORT_FORMAT,
+    'workers': DEFAULT_WORKERS,
+    'ftrace_instance': DEFAULT_FTRACE_INSTANCE,
+    'c_port': DEFAULT_C_PORT,
+    's_port': DEFAULT_S_PORT,
+    'iperf_json': DEFAULT_IPERF_JSON,
+    'iperf_interval': DEFAULT_IPERF_INTERVAL,
+    'batch_links': DEFAULT_BATCH_LINKS,
+    'capture_profile': DEFAULT_CAPTURE_PROFILE,
+    'capture_bottleneck': DEFAULT_CAPTURE_BOTTLENECK,
+    'live_view': DEFAULT_LIVE_VIEW,
+    'ftrace_filter': DEFAULT_FTRACE_FILTER,
+    'ftrace_sample': DEFAULT_FTRACE_SAMPLE,
+    'raw_ftrace': DEFAULT_RAW_FTRACE,
+    'cprofile': DEFAULT_CPROFILE,
+    'count_written': DEFAULT_COUNT_WRITTEN,
+    'ftrace_strict': DEFAULT_FTRACE_STRICT,
+    'compression': DEFAULT_COMPRESSION,
+    'pipeline': DEFAULT_PIPELINE
   }
   
   i = 1
@@ -403,6 +906,106 @@ def argParser(args):
         except ValueError:
           raise ArgumentError(f"One or more delays in '{args[i]}' is not a valid delay. Use -h for more information")
           
+    elif args[i] == '-s':
+      config['stream_ftrace'] = True
+
+    elif args[i] == '-f':
+      i += 1
+      if optionHasArg(i, args, '-f'):
+        export_format = args[i]
+        if not export_format in EXPORT_FORMATS:
+          raise ArgumentError(f"'{export_format}' is not a valid export format. Use -h for more information")
+        elif not exportFormatAvailable(export_format):
+          raise ArgumentError(f"Export format '{export_format}' requires pyarrow, which is not installed")
+        else:
+          config['export_format'] = export_format
+
+    elif args[i] == '-w':
+      i += 1
+      if optionHasArg(i, args, '-w'):
+        if isInt(args[i]) and int(args[i]) > 0:
+          config['workers'] = int(args[i])
+        else:
+          raise ArgumentError(f"'{args[i]}' is not a valid number of workers. Use -h for more information")
+
+    elif args[i] == '-i':
+      config['ftrace_instance'] = True
+
+    elif args[i] == '-p':
+      i += 1
+      if optionHasArg(i, args, '-p'):
+        ports = args[i].split(',')
+        if len(ports) == 2 and validatePorts(ports):
+          config['c_port'], config['s_port'] = ports
+        else:
+          raise ArgumentError(f"'{args[i]}' is not a valid client and server port pair. Use -h for more information")
+
+    elif args[i] == '-j':
+      config['iperf_json'] = True
+
+    elif args[i] == '-I':
+      i += 1
+      if optionHasArg(i, args, '-I'):
+        try:
+          if float(args[i]) > 0:
+            config['iperf_interval'] = float(args[i])
+          else:
+            raise ArgumentError(f"'{args[i]}' is not a valid iperf3 interval. Use -h for more information")
+        except ValueError:
+          raise ArgumentError(f"'{args[i]}' is not a valid iperf3 interval. Use -h for more information")
+
+    elif args[i] == '-b':
+      config['batch_links'] = True
+
+    elif args[i] == '-c':
+      i += 1
+      if optionHasArg(i, args, '-c'):
+        if args[i] in CAPTURE_PROFILES:
+          config['capture_profile'] = args[i]
+        else:
+          raise ArgumentError(f"'{args[i]}' is not a valid capture profile. Use -h for more information")
+
+    elif args[i] == '-B':
+      config['capture_bottleneck'] = True
+
+    elif args[i] == '-L':
+      config['live_view'] = True
+
+    elif args[i] == '-u':
+      config['ftrace_filter'] = False
+
+    elif args[i] == '-S':
+      i += 1
+      if optionHasArg(i, args, '-S'):
+        if validateSample(args[i]):
+          config['ftrace_sample'] = int(args[i])
+        else:
+          raise ArgumentError(f"'{args[i]}' is not a valid sampling rate, it must be a power of two. Use -h for more information")
+
+    elif args[i] == '-r':
+      config['raw_ftrace'] = True
+
+    elif args[i] == '-P':
+      config['cprofile'] = True
+
+    elif args[i] == '-W':
+      config['count_written'] = True
+
+    elif args[i] == '-F':
+      config['ftrace_strict'] = True
+
+    elif args[i] == '-A':
+      config['pipeline'] = True
+
+    elif args[i] == '-z':
+      i += 1
+      if optionHasArg(i, args, '-z'):
+        if not args[i] in COMPRESSION_SUFFIXES:
+          raise ArgumentError(f"'{args[i]}' is not a valid compressor. Use -h for more information")
+        elif not compressionAvailable(args[i]):
+          raise ArgumentError(f"Compressor '{args[i]}' requires zstandard, which is not installed")
+        else:
+          config['compression'] = args[i]
 
     else:
       raise ArgumentError(f"'{args[i]}' is not a valid option. Use -h for more information")
@@ -411,6 +1014,16 @@ def argParser(args):
 
     i += 1
 
+  # each host pair gets its own ports, counting up from the given ones
+  if not validatePorts([config['c_port'], config['s_port']], config['num_host_pairs']):
+    raise ArgumentError(f"Ports {config['c_port']},{config['s_port']} do not leave room for {config['num_host_pairs']} host pairs. Use -h for more information")
+
+  if config['raw_ftrace'] and config['live_view']:
+    raise ArgumentError("-r and -L can not be used together, the live view follows the text trace. Use -h for more information")
+
+  if config['compression'] is not None and config['live_view']:
+    raise ArgumentError("-z and -L can not be used together, the live view follows the uncompressed trace and ping output. Use -h for more information")
+
   return config 
           
       
@@ -424,11 +1037,38 @@ if __name__ == '__main__':
     #print(config)
     
     if config['custom'] == None:
-      topo = Dumbbell(config['link_config'], config['num_host_pairs'])
+      topo = Dumbbell(config['link_config'], config['num_host_pairs'], config['batch_links'])
     else:
       topo = config['custom']
 
-    testDriver(topo, config['algs'], config['runtime'], config['lc_name'], config['delays'])
+    testDriver(
+      topo,
+      config['algs'],
+      config['runtime'],
+      config['lc_name'],
+      config['delays'],
+      config['stream_ftrace'],
+      config['export_format'],
+      config['workers'],
+      ftrace_instance=config['ftrace_instance'],
+      c_port=config['c_port'],
+      s_port=config['s_port'],
+      iperf_json=config['iperf_json'],
+      iperf_interval=config['iperf_interval'],
+      capture_profile=config['capture_profile'],
+      capture_bottleneck=config['capture_bottleneck'],
+      live_view=config['live_view'],
+      ftrace_filter=config['ftrace_filter'],
+      ftrace_sample=config['ftrace_sample'],
+      raw_ftrace=config['raw_ftrace'],
+      cprofile=config['cprofile'],
+      ftrace_strict=config['ftrace_strict'],
+      compression=config['compression'],
+      pipeline=AnalysisPipeline() if config['pipeline'] else None,
+      count_written=config['count_written']
+    )
   except ArgumentError as e:
     print(e)
+  except TraceLossError as e:
+    sys.exit(e.message)
 
@@ -1,8 +1,14 @@
 # Author: Joshua Woelfel
 # jwolf083@mtroyal.ca
 
+from mininet.net import Mininet
 from mininet.topo import Topo
-from mininet.link import TCLink
+from mininet.link import TCLink, TCIntf
+from mininet.node import Switch
+
+import os
+import time
+import tempfile
 
 # Link configuration presets for Dumbbell topology class. All hosts left of 
 # bottleneck will use the link configuration of the first element, 
@@ -43,6 +49,125 @@ LINK_CONFIG = {
   }]
 }
 
+# Host pair count from which links are configured in batches, see BatchTCIntf
+BATCH_LINKS_THRESHOLD = 32
+
+# BatchTCIntf Class
+# A TCIntf that queues its tc and ethtool commands on its node while a
+# BatchMininet network is being built, instead of running each one in the
+# node's shell as it is configured. Configuring a TCLink otherwise runs a tc
+# qdisc show, qdisc del and one command per qdisc on both ends, each a separate
+# round trip to the node's shell, which dominates setup time with hundreds of
+# host pairs. Outside of a BatchMininet build it configures itself as a TCIntf
+# does.
+class BatchTCIntf(TCIntf):
+  def tc(self, cmd, tc='tc'):
+    batch = getattr(self.node, 'link_batch', None)
+    if batch is None:
+      return TCIntf.tc(self, cmd, tc)
+
+    # a newly created veth has no qdisc of its own to delete first
+    if 'qdisc show' in cmd:
+      return 'noqueue'
+
+    batch.append(cmd % (tc, self))
+    return ''
+
+  def cmd(self, *args, **kwargs):
+    batch = getattr(self.node, 'link_batch', None)
+    if batch is not None and len(args) > 0 and str(args[0]).startswith('ethtool'):
+      batch.append(' '.join(str(arg) for arg in args))
+      return ''
+
+    return TCIntf.cmd(self, *args, **kwargs)
+
+# TCLink whose interfaces queue their configuration, see BatchTCIntf
+class BatchTCLink(TCLink):
+  def __init__(self, *args, **kwargs):
+    kwargs.setdefault('cls1', BatchTCIntf)
+    kwargs.setdefault('cls2', BatchTCIntf)
+    TCLink.__init__(self, *args, **kwargs)
+
+# Runs the commands queued by BatchTCIntf on node, writing its tc commands to a
+# file read by a single "tc -batch" in the node's shell. Commands of links
+# added to node later are run as they are configured.
+# Returns the number of commands run
+def applyLinkBatch(node):
+  cmds = getattr(node, 'link_batch', None) or []
+  node.link_batch = None
+  tc_cmds = [cmd[len('tc '):] for cmd in cmds if cmd.startswith('tc ')]
+  other_cmds = [cmd for cmd in cmds if not cmd.startswith('tc ')]
+
+  if len(tc_cmds) > 0:
+    batch_fd, batch_path = tempfile.mkstemp(prefix=f"tc_{node.name}_", suffix=".batch")
+    with os.fdopen(batch_fd, 'w') as batch_file:
+      batch_file.write('\n'.join(tc_cmds) + '\n')
+    output = node.cmd(f"tc -force -batch {batch_path}")
+    os.remove(batch_path)
+    if output.strip():
+      print(f"*** Error configuring links of {node.name}: {output}")
+
+  if len(other_cmds) > 0:
+    node.cmd(' ; '.join(other_cmds))
+
+  return len(cmds)
+
+# BatchMininet Class
+# A Mininet network whose nodes queue the configuration of their BatchTCLinks
+# while the network is built, and run it with one tc batch per node once the
+# topology is built. Each node keeps its own queue, so no commands are shared
+# between networks. The seconds spent adding each host's links and running
+# its batch are recorded in setup_times by host name, with the time of a link
+# between two hosts split between them. Time spent on links between switches
+# and on the switches' batches is not any one host's.
+class BatchMininet(Mininet):
+  def __init__(self, *args, **kwargs):
+    self.setup_times = {}
+    Mininet.__init__(self, *args, **kwargs)
+
+  def addHost(self, *args, **kwargs):
+    host = Mininet.addHost(self, *args, **kwargs)
+    host.link_batch = []
+    return host
+
+  def addSwitch(self, *args, **kwargs):
+    switch = Mininet.addSwitch(self, *args, **kwargs)
+    switch.link_batch = []
+    return switch
+
+  def addLink(self, *args, **kwargs):
+    started = time.monotonic()
+    link = Mininet.addLink(self, *args, **kwargs)
+    self._addSetupTime([link.intf1.node, link.intf2.node], time.monotonic() - started)
+    return link
+
+  def build(self):
+    Mininet.build(self)
+    for node in self.hosts + self.switches:
+      started = time.monotonic()
+      applyLinkBatch(node)
+      self._addSetupTime([node], time.monotonic() - started)
+
+  def _addSetupTime(self, nodes, seconds):
+    hosts = [node for node in nodes if not isinstance(node, Switch)]
+    for host in hosts:
+      self.setup_times[host.name] = self.setup_times.get(host.name, 0.0) + seconds / len(hosts)
+
+# Creates and starts a BatchMininet network from topo. Records the seconds
+# taken as topo.setup_time, and the seconds spent on each host pair's own links
+# as topo.pair_setup_times, in the order of topo.getNodePairNames().
+# Returns the started network
+def startNetwork(topo):
+  setup_start = time.monotonic()
+  net = BatchMininet(topo)
+  net.start()
+  topo.setup_time = time.monotonic() - setup_start
+  topo.pair_setup_times = [
+    net.setup_times.get(l_name, 0.0) + net.setup_times.get(r_name, 0.0) for l_name, r_name in topo.getNodePairNames()
+  ]
+
+  return net
+
 # Dumbbell Class
 # Creates a Mininet topology class in the form of a dumbell. Two switches are 
 # connected to each others via a bottleneck link,  and each switch has an equal
@@ -50,6 +175,10 @@ LINK_CONFIG = {
 # TODO: Draw picture:
 class Dumbbell(Topo):
   _node_pair_names = []
+  # seconds startNetwork took to create and start a network from this topology,
+  # and the part of it spent on each node pair's links
+  setup_time = None
+  pair_setup_times = None
  
   # Builds the topology with the given link configuration and number of node 
   # pairs on the left and right of the center bottleneck link.
@@ -60,10 +189,21 @@ class Dumbbell(Topo):
   #   - the third element being the link configuration of all links connecting hosts to the switch right of the bottleneck link
   #  
   # num_node_pairs: int representing the number of hosts to create left and right of the bottleneck  
-  def build(self, lconfig, num_node_pairs=1):
+  # batch_links: if True, links are configured with one tc batch per node when
+  #   the network is a BatchMininet, see BatchTCIntf. None does so from
+  #   BATCH_LINKS_THRESHOLD host pairs on.
+  def build(self, lconfig, num_node_pairs=1, batch_links=None):
+    # names are kept per instance so building another topology does not add
+    # to this one
+    self._node_pair_names = []
+
+    if batch_links is None:
+      batch_links = num_node_pairs >= BATCH_LINKS_THRESHOLD
+    link_cls = BatchTCLink if batch_links else TCLink
+
     l_switch = self.addSwitch('s1')
     r_switch = self.addSwitch('s2')
-    self.addLink(l_switch, r_switch, cls=TCLink, **lconfig[1])
+    self.addLink(l_switch, r_switch, cls=link_cls, **lconfig[1])
 
     for i in range(1, num_node_pairs + 1):
       l_host_name = f"h{i}"
@@ -74,9 +214,13 @@ class Dumbbell(Topo):
       l_host = self.addHost(l_host_name)
       r_host = self.addHost(r_host_name)
 
-      self.addLink(l_host, l_switch, cls=TCLink, **lconfig[0])
-      self.addLink(r_switch, r_host, cls=TCLink, **lconfig[2])
+      self.addLink(l_host, l_switch, cls=link_cls, **lconfig[0])
+      self.addLink(r_switch, r_host, cls=link_cls, **lconfig[2])
 
   def getNodePairNames(self):
       return self._node_pair_names[:]
+
+  # Returns the names of the left and right switch of the bottleneck link
+  def getBottleneckNames(self):
+    return ('s1', 's2')
     
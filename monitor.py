@@ -0,0 +1,189 @@
+import os
+import sys
+import time
+import threading
+import numpy as np
+
+from utils import *
+
+# Seconds between redraws of the live view
+LIVE_REFRESH = 1.0
+# Seconds of samples folded into each point of a live view graph, and the
+# number of points kept per graph
+LIVE_BUCKET = 0.5
+LIVE_HISTORY = 60
+# Most bytes of new trace output parsed per redraw. If the trace grows faster
+# only its newest LIVE_MAX_READ bytes are parsed, so the view's cpu use stays
+# bounded however busy the links are. The trace on disk is unaffected
+LIVE_MAX_READ = 1024 * 1024
+# Most flows drawn, the rest are counted below the view
+LIVE_MAX_FLOWS = 16
+# Niceness the live view runs at, so it yields the cpu to the emulation
+LIVE_NICENESS = 10
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+# _DecimatedRing Class
+# Fixed size ring of the last LIVE_HISTORY buckets of a time series, each
+# bucket keeping the last value added to it. Memory use is constant however
+# many values are added
+class _DecimatedRing:
+  def __init__(self, capacity=LIVE_HISTORY, width=LIVE_BUCKET):
+    self.width = width
+    self.buckets = np.full(capacity, -1, dtype=np.int64)
+    self.values = np.full(capacity, np.nan)
+    self.latest = np.nan
+
+  # Adds values at times, both numpy arrays with times in increasing order
+  def add(self, times, values):
+    if len(times) == 0:
+      return
+
+    buckets = (times // self.width).astype(np.int64)
+    # the last value of each bucket is the first of the reversed arrays
+    buckets, last = np.unique(buckets[::-1], return_index=True)
+    slots = buckets % len(self.buckets)
+    self.buckets[slots] = buckets
+    self.values[slots] = values[::-1][last]
+    self.latest = values[-1]
+
+  # Returns the values of the buckets up to the one holding time now, oldest
+  # first, with NaN for buckets nothing was added to
+  def series(self, now):
+    buckets = np.arange(int(now // self.width) - len(self.buckets) + 1, int(now // self.width) + 1)
+    slots = buckets % len(self.buckets)
+    return np.where(self.buckets[slots] == buckets, self.values[slots], np.nan)
+
+# _Tail Class
+# Follows a file being written by another process, returning only the whole
+# lines added since the last read
+class _Tail:
+  def __init__(self, path, max_read=None):
+    self.path = path
+    self.max_read = max_read
+    self.offset = 0
+    self.partial = b""
+
+  # Returns the complete lines written since the last call as bytes. If more
+  # than max_read bytes were written, older ones are skipped
+  def read(self):
+    try:
+      size = os.path.getsize(self.path)
+    except OSError:
+      return b""
+
+    if self.max_read is not None and size - self.offset > self.max_read:
+      self.offset = size - self.max_read
+      self.partial = None
+
+    with open(self.path, 'rb') as tail_file:
+      tail_file.seek(self.offset)
+      data = tail_file.read(size - self.offset)
+    self.offset += len(data)
+
+    # after skipping ahead the first line is cut short, so drop it
+    if self.partial is None:
+      newline = data.find(b'\n')
+      data = data[newline + 1:] if newline >= 0 else b""
+      self.partial = b""
+
+    data = self.partial + data
+    end = data.rfind(b'\n') + 1
+    self.partial = data[end:]
+    return data[:end]
+
+# LiveMonitor Class
+# Draws the CWND and RTT of each flow of a run in the terminal while it runs,
+# from a background thread that tails the streamed ftrace file and each host
+# pair's ping output
+#
+# ftrace_file: file tcp_probe events are streamed to, see FtraceStreamer
+# flows: list of dicts with the "name" of each flow, its "key" in the ftrace
+#        output as a (src "ip:port", dest "ip:port") tuple, and its "ping" file
+# clock_offset: see getClockOffset, used to put ping's timestamps on the
+#               ftrace clock
+class LiveMonitor:
+  def __init__(self, ftrace_file, flows, clock_offset=0.0, refresh=LIVE_REFRESH, out=sys.stdout):
+    self.flows = flows
+    self.clock_offset = clock_offset
+    self.refresh = refresh
+    self.out = out
+    self._ftrace = _Tail(ftrace_file, LIVE_MAX_READ)
+    self._pings = [_Tail(flow['ping'], LIVE_MAX_READ) for flow in flows]
+    self._layout = None
+    self._cwnd = {flow['key']: _DecimatedRing() for flow in flows}
+    self._rtt = [_DecimatedRing() for flow in flows]
+    self._stop_event = threading.Event()
+    self._thread = None
+    self._started = None
+
+  def start(self):
+    self._started = time.monotonic()
+    self._stop_event.clear()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  # Stops the background thread after one last redraw
+  def stop(self):
+    if self._thread is not None:
+      self._stop_event.set()
+      self._thread.join()
+      self._thread = None
+
+  def _run(self):
+    try:
+      # on linux this lowers the priority of this thread only
+      os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), LIVE_NICENESS)
+    except (OSError, AttributeError):
+      pass
+
+    while not self._stop_event.wait(self.refresh):
+      self._update()
+      self._draw()
+    self._update()
+    self._draw()
+
+  # Adds the samples written since the last update to each flow's rings
+  def _update(self):
+    chunk = self._ftrace.read()
+    chunk_flows = {}
+    if len(chunk) > 0:
+      chunk_flows, self._layout = parseFtraceChunk(chunk, self._layout)
+    for key, (times, columns) in chunk_flows.items():
+      if key in self._cwnd:
+        self._cwnd[key].add(times, columns['CWND'])
+
+    for ping, ring in zip(self._pings, self._rtt):
+      replies = PING_REPLY_PATTERN.findall(ping.read())
+      # only timestamped replies can be placed on the trace clock
+      replies = [reply for reply in replies if reply[0]]
+      if len(replies) > 0:
+        ring.add(
+          np.array([float(reply[0]) for reply in replies]) - self.clock_offset,
+          np.array([float(reply[2]) for reply in replies])
+        )
+
+  def _draw(self):
+    now = time.monotonic()
+    lines = [f"Live view, {now - self._started:.0f}s  (CWND in segments, RTT in ms, last {LIVE_HISTORY * LIVE_BUCKET:.0f}s)"]
+    for flow, rtt in list(zip(self.flows, self._rtt))[:LIVE_MAX_FLOWS]:
+      cwnd = self._cwnd[flow['key']]
+      lines.append(f"{flow['name']:<12} CWND {cwnd.latest:>8.0f} {sparkline(cwnd.series(now))}")
+      lines.append(f"{'':<12} RTT  {rtt.latest:>8.1f} {sparkline(rtt.series(now))}")
+    if len(self.flows) > LIVE_MAX_FLOWS:
+      lines.append(f"... and {len(self.flows) - LIVE_MAX_FLOWS} more flows")
+
+    # move to the top left and clear the screen before drawing
+    self.out.write("\x1b[H\x1b[J" + "\n".join(lines) + "\n")
+    self.out.flush()
+
+# Draws values as a row of block characters scaled to their maximum, with a
+# space for NaN values.
+# Returns the row as string
+def sparkline(values):
+  peak = np.nanmax(values) if not np.isnan(values).all() else 0
+  if peak <= 0:
+    return "".join(" " if np.isnan(value) else SPARK_CHARS[0] for value in values)
+
+  levels = np.nan_to_num(values / peak * (len(SPARK_CHARS) - 1)).astype(int)
+  return "".join(" " if np.isnan(value) else SPARK_CHARS[level] for value, level in zip(values, levels))
@@ -0,0 +1,307 @@
+import sys
+import os
+import csv
+import json
+import time
+import itertools
+
+from utils import *
+from dumbbell import Dumbbell, startNetwork
+from dumbbell import LINK_CONFIG as lc
+from cinspect import *
+
+# Files kept in a sweep's directory. COMPLETED_NAME records one json line per
+# finished cell and is what an interrupted sweep resumes from. FAILED_NAME
+# records a line per attempt at a cell whose trace was incomplete, which is
+# run again when the sweep is resumed
+MATRIX_NAME = "matrix.json"
+COMPLETED_NAME = "completed.jsonl"
+FAILED_NAME = "failed.jsonl"
+INDEX_NAME = "index.csv"
+
+DEFAULT_SWEEP_NAME = "sweep"
+DEFAULT_REPETITIONS = 1
+
+# Reads and validates the sweep matrix file at path. The matrix is a json
+# object with the following keys, of which only "link_configs" is required:
+#
+# name: name of the sweep, used for its directory in DEFAULT_OUTPUT_DIR
+# link_configs: list of dumbbell.LINK_CONFIG keys
+# alg_sets: list of congestion algorithm lists, as passed to cinspect.py -a
+# pair_counts: list of host pair counts
+# delay_sets: list of delay lists, as passed to cinspect.py -d
+# repetitions: number of times each cell is run
+# runtime, stream_ftrace, export_format, workers, ftrace_instance, c_port,
+#   s_port, iperf_json, iperf_interval, capture_profile, capture_bottleneck,
+#   ftrace_filter, ftrace_sample, raw_ftrace, cprofile, ftrace_strict,
+#   compression, count_written: testDriver options used by every cell
+# batch_links: Dumbbell option used by every topology
+# pipeline: if true, each cell is analyzed by a cinspect.AnalysisPipeline
+#           while the next is captured
+#
+# Raises ArgumentError if any value is invalid.
+# Returns the matrix as a dict with defaults filled in
+def loadMatrix(path):
+  try:
+    with open(path, 'r') as matrix_file:
+      matrix = json.load(matrix_file)
+  except (OSError, ValueError) as e:
+    raise ArgumentError(f"Could not read sweep matrix '{path}': {e}")
+
+  matrix = {
+    'name': DEFAULT_SWEEP_NAME,
+    'alg_sets': [DEFAULT_ALGS],
+    'pair_counts': [DEFAULT_NUM_HOST_PAIRS],
+    'delay_sets': [DEFAULT_DELAYS],
+    'repetitions': DEFAULT_REPETITIONS,
+    'runtime': DEFAULT_RUNTIME,
+    'stream_ftrace': DEFAULT_STREAM_FTRACE,
+    'export_format': DEFAULT_EXPORT_FORMAT,
+    'workers': DEFAULT_WORKERS,
+    'ftrace_instance': DEFAULT_FTRACE_INSTANCE,
+    'c_port': DEFAULT_C_PORT,
+    's_port': DEFAULT_S_PORT,
+    'iperf_json': DEFAULT_IPERF_JSON,
+    'iperf_interval': DEFAULT_IPERF_INTERVAL,
+    'batch_links': DEFAULT_BATCH_LINKS,
+    'capture_profile': DEFAULT_CAPTURE_PROFILE,
+    'capture_bottleneck': DEFAULT_CAPTURE_BOTTLENECK,
+    'ftrace_filter': DEFAULT_FTRACE_FILTER,
+    'ftrace_sample': DEFAULT_FTRACE_SAMPLE,
+    'raw_ftrace': DEFAULT_RAW_FTRACE,
+    'cprofile': DEFAULT_CPROFILE,
+    'count_written': DEFAULT_COUNT_WRITTEN,
+    'ftrace_strict': DEFAULT_FTRACE_STRICT,
+    'compression': DEFAULT_COMPRESSION,
+    'pipeline': DEFAULT_PIPELINE,
+    **matrix
+  }
+  matrix['runtime'] = str(matrix['runtime'])
+  matrix['c_port'] = str(matrix['c_port'])
+  matrix['s_port'] = str(matrix['s_port'])
+
+  if not 'link_configs' in matrix or len(matrix['link_configs']) == 0:
+    raise ArgumentError("Sweep matrix must list at least one link configuration in 'link_configs'")
+  for config_name in matrix['link_configs']:
+    if not config_name in lc:
+      raise ArgumentError(f"'{config_name}' is not a valid link configuration")
+  for algs in matrix['alg_sets']:
+    if not validateAlgs(algs):
+      raise ArgumentError(f"One or more congestion algorithms in {algs} is invalid")
+  for num_host_pairs in matrix['pair_counts']:
+    if not isInt(num_host_pairs) or int(num_host_pairs) <= 0:
+      raise ArgumentError(f"'{num_host_pairs}' is not a valid number of client/server hosts")
+  for delays in matrix['delay_sets']:
+    if not validateDelays(delays):
+      raise ArgumentError(f"One or more delays in {delays} is not a valid delay")
+  if not isInt(matrix['runtime']) or int(matrix['runtime']) <= 0:
+    raise ArgumentError(f"'{matrix['runtime']}' is not a valid runtime")
+  if not isInt(matrix['repetitions']) or int(matrix['repetitions']) <= 0:
+    raise ArgumentError(f"'{matrix['repetitions']}' is not a valid number of repetitions")
+  if not validatePorts([matrix['c_port'], matrix['s_port']], max((int(count) for count in matrix['pair_counts']), default=1)):
+    raise ArgumentError(f"'{matrix['c_port']},{matrix['s_port']}' is not a valid client and server port pair for every pair count")
+  if not matrix['capture_profile'] in CAPTURE_PROFILES:
+    raise ArgumentError(f"'{matrix['capture_profile']}' is not a valid capture profile")
+  if not validateSample(matrix['ftrace_sample']):
+    raise ArgumentError(f"'{matrix['ftrace_sample']}' is not a valid tcp_probe sampling rate")
+  if not exportFormatAvailable(matrix['export_format']):
+    raise ArgumentError(f"'{matrix['export_format']}' is not an available export format")
+  if matrix['compression'] is not None and not compressionAvailable(matrix['compression']):
+    raise ArgumentError(f"'{matrix['compression']}' is not an available compressor")
+
+  return matrix
+
+# Expands matrix into the list of cells it describes. Cells that share a
+# topology (link configuration and pair count) are listed next to each other
+# so they can run on the same network.
+# Returns a list of dicts, each with a unique "cell" id
+def expandMatrix(matrix):
+  cells = []
+  for config_name, num_host_pairs, algs, delays, repetition in itertools.product(
+    matrix['link_configs'],
+    matrix['pair_counts'],
+    matrix['alg_sets'],
+    matrix['delay_sets'],
+    range(int(matrix['repetitions']))
+  ):
+    alg_desc = ",".join(algs) if len(algs) > 0 else "default"
+    delay_desc = ",".join(str(delay) for delay in delays)
+    cells.append({
+      'cell': f"{config_name}_n{num_host_pairs}_{alg_desc}_d{delay_desc}_r{repetition}",
+      'link_config': config_name,
+      'num_host_pairs': int(num_host_pairs),
+      'algs': algs,
+      'delays': delays,
+      'repetition': repetition
+    })
+
+  return cells
+
+# Reads the cells already finished in the sweep saved in sweep_dir.
+# Returns a dict of the completed records keyed by cell id
+def loadCompleted(sweep_dir):
+  completed = {}
+  path = sweep_dir + COMPLETED_NAME
+  if os.path.exists(path):
+    with open(path, 'r') as completed_file:
+      for line in completed_file:
+        # a partially written last line means we stopped while recording it
+        try:
+          record = json.loads(line)
+        except ValueError:
+          continue
+        completed[record['cell']] = record
+
+  return completed
+
+# Records cell as finished with its results saved to output_dir
+def markCompleted(sweep_dir, cell, output_dir):
+  record = dict(cell, output_dir=output_dir, finished=int(time.time()))
+  with open(sweep_dir + COMPLETED_NAME, 'a') as completed_file:
+    completed_file.write(json.dumps(record) + "\n")
+    completed_file.flush()
+    os.fsync(completed_file.fileno())
+
+  return record
+
+# Records an attempt at cell that failed with error, its results saved to
+# output_dir
+def markFailed(sweep_dir, cell, output_dir, error):
+  record = dict(cell, output_dir=output_dir, error=error, failed=int(time.time()))
+  with open(sweep_dir + FAILED_NAME, 'a') as failed_file:
+    failed_file.write(json.dumps(record) + "\n")
+
+  return record
+
+# Writes a csv index of every finished cell of cells and the directory its
+# results were saved to
+def saveIndex(sweep_dir, cells, completed):
+  with open(sweep_dir + INDEX_NAME, 'w', newline='') as index_file:
+    writer = csv.writer(index_file)
+    writer.writerow(['cell', 'link_config', 'num_host_pairs', 'algs', 'delays', 'repetition', 'output_dir'])
+    for cell in cells:
+      if cell['cell'] in completed:
+        writer.writerow([
+          cell['cell'],
+          cell['link_config'],
+          cell['num_host_pairs'],
+          ",".join(cell['algs']),
+          ",".join(str(delay) for delay in cell['delays']),
+          cell['repetition'],
+          completed[cell['cell']]['output_dir']
+        ])
+
+# Sets the congestion algorithm of every host in net back to algs, a dict of
+# algorithm names by host name, so a reused network starts each cell the same
+def resetCongAlgs(net, algs):
+  for host in net.hosts:
+    if host.name in algs:
+      setCongAlg(host, algs[host.name])
+
+# Runs every cell of matrix not already recorded as finished in sweep_dir, one
+# after another. Cells sharing a topology run on the same Mininet network, so
+# it is only started and stopped once per link configuration and pair count.
+# Pipelined cells are only recorded as finished once their analysis succeeds.
+# A cell whose trace is incomplete with ftrace_strict is recorded as failed
+# and the sweep carries on with the next.
+# Returns the records of the cells that failed
+def runSweep(matrix, sweep_dir):
+  checkDir(sweep_dir)
+  with open(sweep_dir + MATRIX_NAME, 'w') as matrix_file:
+    json.dump(matrix, matrix_file, indent=2)
+
+  cells = expandMatrix(matrix)
+  completed = loadCompleted(sweep_dir)
+  remaining = [cell for cell in cells if not cell['cell'] in completed]
+  print(f"\nSweep '{matrix['name']}': {len(cells)} cells, {len(cells) - len(remaining)} already finished")
+
+  pipeline = AnalysisPipeline() if matrix['pipeline'] else None
+  # cells whose capture finished, keyed by their output directory, until
+  # their analysis has too
+  analyzing = {}
+  failed = []
+
+  def markAnalyzed(output_dirs):
+    for output_dir in output_dirs:
+      cell = analyzing.pop(output_dir)
+      completed[cell['cell']] = markCompleted(sweep_dir, cell, output_dir)
+    saveIndex(sweep_dir, cells, completed)
+
+  try:
+    for (config_name, num_host_pairs), topo_cells in itertools.groupby(
+      remaining, key=lambda cell: (cell['link_config'], cell['num_host_pairs'])
+    ):
+      topo = Dumbbell(lc[config_name], num_host_pairs, matrix['batch_links'])
+      net = startNetwork(topo)
+      print(f"\nNetwork for {config_name} with {num_host_pairs} host pairs set up in {topo.setup_time:.2f} seconds")
+
+      try:
+        initial_algs = {host.name: getCongAlg(host) for host in net.hosts}
+
+        for cell in topo_cells:
+          print(f"\n**********Running sweep cell {cell['cell']}**************")
+          resetCongAlgs(net, initial_algs)
+          try:
+            output_dir = testDriver(
+              topo,
+              cell['algs'],
+              matrix['runtime'],
+              config_name,
+              cell['delays'],
+              matrix['stream_ftrace'],
+              matrix['export_format'],
+              matrix['workers'],
+              net,
+              matrix['ftrace_instance'],
+              matrix['c_port'],
+              matrix['s_port'],
+              matrix['iperf_json'],
+              matrix['iperf_interval'],
+              matrix['capture_profile'],
+              matrix['capture_bottleneck'],
+              ftrace_filter=matrix['ftrace_filter'],
+              ftrace_sample=int(matrix['ftrace_sample']),
+              raw_ftrace=matrix['raw_ftrace'],
+              cprofile=matrix['cprofile'],
+              ftrace_strict=matrix['ftrace_strict'],
+              compression=matrix['compression'],
+              pipeline=pipeline,
+              count_written=matrix['count_written']
+            )
+          except TraceLossError as e:
+            print(f"\nSweep cell {cell['cell']} failed: {e.message}")
+            failed.append(markFailed(sweep_dir, cell, e.output_dir, e.message))
+            continue
+          analyzing[output_dir] = cell
+          markAnalyzed([output_dir] if pipeline is None else pipeline.collect())
+      finally:
+        net.stop()
+  finally:
+    # a cell whose capture finished is only recorded once its analysis has,
+    # so an interrupted sweep still waits for the cells already handed over
+    if len(analyzing) > 0:
+      print(f"\nWaiting for the analysis of {len(analyzing)} cells")
+      markAnalyzed(pipeline.collect(wait=True))
+
+  saveIndex(sweep_dir, cells, completed)
+  print(f"\n\nSweep index saved to the following location: {sweep_dir}{INDEX_NAME}")
+
+  return failed
+
+if __name__ == '__main__':
+  try:
+    if len(sys.argv) < 2:
+      raise ArgumentError("Usage: sweep.py <matrix file> [sweep directory]")
+
+    matrix = loadMatrix(sys.argv[1])
+    sweep_dir = DEFAULT_OUTPUT_DIR + matrix['name'] + '/'
+    if len(sys.argv) > 2:
+      sweep_dir = os.path.join(sys.argv[2], '')
+
+    failed = runSweep(matrix, sweep_dir)
+    if len(failed) > 0:
+      # their results are saved, but they are not marked finished so they are
+      # run again when the sweep is resumed
+      sys.exit(f"{len(failed)} cells had incomplete traces, see {sweep_dir}{FAILED_NAME}")
+  except ArgumentError as e:
+    print(e)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from benchmark import genRun, benchmarkRun, benchFlows, BENCH_FTRACE_ORIGIN, BENCH_RETRANSMIT_EVERY
+from utils import parseFtraceFlows, getFtraceFlow, parsePcapFlows, getPcapFlow, pcapFiles
+
+# Generates a run of 10^4 tcp_probe events from 2 flows and checks every
+# stage is measured and each flow's events are parsed
+def test_benchmarkRun(tmp_path):
+  flows = 2
+  run_dir = genRun(str(tmp_path), 10 ** 4, flows, runtime=60)
+  results = benchmarkRun(run_dir, flows, plots=1, runtime=60)
+
+  assert set(results) == {
+    'ftrace_parse', 'raw_ftrace_parse', 'pcap_parse', 'cache_store', 'cache_load', 'ftrace_window', 'raw_ftrace_window',
+    'ping_parse', 'iperf_parse', 'export', 'plot'
+  }
+  for result in results.values():
+    assert result['duration'] >= 0
+
+  for flow in benchFlows(flows):
+    ftrace = pd.read_csv(run_dir + "out/" + flow['result_dir'] + "ftrace.csv")
+    assert len(ftrace) == 10 ** 4 // flows
+
+# The raw trace holds the same events as the text trace, and the capture a
+# segment per event with its retransmits
+def test_genRun_artifacts_match(tmp_path):
+  flows = 2
+  run_dir = genRun(str(tmp_path), 10 ** 4, flows, runtime=60)
+  text_flows = parseFtraceFlows(run_dir + "ftrace_raw.txt", BENCH_FTRACE_ORIGIN)
+  raw_flows = parseFtraceFlows(run_dir + "ftrace_raw/", BENCH_FTRACE_ORIGIN)
+  assert set(raw_flows) == set(text_flows)
+  pcap_flows = parsePcapFlows(pcapFiles(run_dir + "bottleneck_tcpdump.pcap"))
+
+  for flow in benchFlows(flows):
+    text = getFtraceFlow(text_flows, flow['client_ip'], flow['c_port'], flow['server_ip'], flow['s_port'])
+    raw = getFtraceFlow(raw_flows, flow['client_ip'], flow['c_port'], flow['server_ip'], flow['s_port'])
+    assert np.allclose(raw['Time'], text['Time'], atol=1e-6)
+    assert raw['CWND'].tolist() == text['CWND'].tolist()
+
+    pcap = getPcapFlow(pcap_flows, flow['client_ip'], flow['c_port'], flow['server_ip'], flow['s_port'])
+    assert pcap['Retransmits'].sum() == 10 ** 4 // flows // BENCH_RETRANSMIT_EVERY
+    assert pcap['RTT'].notna().any()
@@ -0,0 +1,182 @@
+import socket
+import struct
+
+import numpy as np
+
+from utils import parseFtraceFlows, getFtraceFlow, parsePcapFlows, getPcapFlow
+
+FTRACE_FIXTURE = """# tracer: nop
+#
+# entries-in-buffer/entries-written: 5/5   #P:4
+#
+          iperf3-1000  [000] ..s1  1000.000100: tcp_probe: src=10.0.0.1:5201 dest=10.0.0.2:5001 mark=0x0 data_len=1448 snd_nxt=0x3890 snd_una=0x0 snd_cwnd=10 ssthresh=2147483647 snd_wnd=3145728 srtt=20000 rcv_wnd=65160 sock_cookie=1
+          iperf3-1000  [000] ..s1  1000.100100: tcp_probe: src=10.0.0.1:5201 dest=10.0.0.2:5001 mark=0x0 data_len=1448 snd_nxt=0x3e38 snd_una=0x5a8 snd_cwnd=40 ssthresh=2147483647 snd_wnd=3145728 srtt=21000 rcv_wnd=65160 sock_cookie=1
+          iperf3-1001  [001] ..s1  1000.150000: tcp_probe: src=10.0.0.1:40001 dest=10.0.0.2:5001 mark=0x0 data_len=0 snd_nxt=0x1 snd_una=0x1 snd_cwnd=10 ssthresh=2147483647 snd_wnd=64256 srtt=100 rcv_wnd=65160 sock_cookie=2
+          <idle>-0     [002] d.h1  1000.180000: sched_wakeup: comm=iperf3 pid=1000 prio=120 target_cpu=000
+          iperf3-1000  [000] ..s1  1000.200100: tcp_probe: src=10.0.0.1:5201 dest=10.0.0.2:5001 mark=0x0 data_len=1448 snd_nxt=0x43e0 snd_una=0xb50 snd_cwnd=20 ssthresh=20 snd_wnd=3145728 srtt=19000 rcv_wnd=65160 sock_cookie=1
+"""
+
+# A CWND drop after loss must come out of diff() as a negative step, not wrap
+# around as it would in the uint32 columns the parser reads into
+def test_parseFtraceFlows_counters_are_int64(tmp_path):
+  path = tmp_path / "ftrace_raw.txt"
+  path.write_text(FTRACE_FIXTURE)
+
+  flows = parseFtraceFlows(str(path))
+  assert set(flows) == {("10.0.0.1:5201", "10.0.0.2:5001"), ("10.0.0.1:40001", "10.0.0.2:5001")}
+
+  ftrace = getFtraceFlow(flows, "10.0.0.1", "5201", "10.0.0.2", "5001")
+  assert np.allclose(ftrace['Time'], [0.0, 0.1, 0.2])
+  assert ftrace['CWND'].tolist() == [10, 40, 20]
+  assert ftrace['SSThresh'].tolist() == [2147483647, 2147483647, 20]
+  assert ftrace['SRTT'].tolist() == [20000, 21000, 19000]
+  for column in ('CWND', 'SSThresh', 'SRTT'):
+    assert ftrace[column].dtype == np.int64
+  assert ftrace['CWND'].diff().tolist()[1:] == [30, -20]
+  assert ftrace['SRTT'].diff().tolist()[1:] == [1000, -2000]
+
+  empty = getFtraceFlow(flows, "10.0.0.3", "5202", "10.0.0.4", "5002")
+  assert len(empty) == 0 and empty['CWND'].dtype == np.int64
+
+RAW_HEADER_PAGE = """\tfield: u64 timestamp;\toffset:0;\tsize:8;\tsigned:0;
+\tfield: local_t commit;\toffset:8;\tsize:8;\tsigned:1;
+\tfield: int overwrite;\toffset:8;\tsize:1;\tsigned:1;
+\tfield: char data;\toffset:16;\tsize:4080;\tsigned:1;
+"""
+
+RAW_TCP_PROBE_FORMAT = """name: tcp_probe
+ID: 1234
+format:
+\tfield:unsigned short common_type;\toffset:0;\tsize:2;\tsigned:0;
+\tfield:unsigned char common_flags;\toffset:2;\tsize:1;\tsigned:0;
+\tfield:unsigned char common_preempt_count;\toffset:3;\tsize:1;\tsigned:0;
+\tfield:int common_pid;\toffset:4;\tsize:4;\tsigned:1;
+
+\tfield:__u8 saddr[sizeof(struct sockaddr_in6)];\toffset:8;\tsize:28;\tsigned:0;
+\tfield:__u8 daddr[sizeof(struct sockaddr_in6)];\toffset:36;\tsize:28;\tsigned:0;
+\tfield:__u16 sport;\toffset:64;\tsize:2;\tsigned:0;
+\tfield:__u16 dport;\toffset:66;\tsize:2;\tsigned:0;
+\tfield:__u32 mark;\toffset:68;\tsize:4;\tsigned:0;
+\tfield:__u16 data_len;\toffset:72;\tsize:2;\tsigned:0;
+\tfield:__u32 snd_nxt;\toffset:76;\tsize:4;\tsigned:0;
+\tfield:__u32 snd_una;\toffset:80;\tsize:4;\tsigned:0;
+\tfield:__u32 snd_cwnd;\toffset:84;\tsize:4;\tsigned:0;
+\tfield:__u32 ssthresh;\toffset:88;\tsize:4;\tsigned:0;
+\tfield:__u32 snd_wnd;\toffset:92;\tsize:4;\tsigned:0;
+\tfield:__u32 srtt;\toffset:96;\tsize:4;\tsigned:0;
+\tfield:__u32 rcv_wnd;\toffset:100;\tsize:4;\tsigned:0;
+\tfield:__u64 sock_cookie;\toffset:104;\tsize:8;\tsigned:0;
+
+print fmt: "src=%pISpc dest=%pISpc"
+"""
+
+# Returns the 28 byte struct sockaddr_in6 sized field of ip:port
+def rawSockaddr(ip, port):
+  return (struct.pack('<H', socket.AF_INET) + struct.pack('!H', port) + socket.inet_aton(ip)).ljust(28, b'\0')
+
+# Returns the data of a tcp_probe event, or of another event if event_id is
+# given
+def rawProbe(src, sport, dest, dport, cwnd, event_id=1234):
+  return (
+    struct.pack('<HBBi', event_id, 0, 0, 1000) + rawSockaddr(src, sport) + rawSockaddr(dest, dport) +
+    struct.pack('<HHIHxxIIIIIIIQ', sport, dport, 0, 1448, 1, 1, cwnd, 2147483647, 1, 20000, 1, 1)
+  )
+
+# Returns an event record with a time delta from the one before, 28 word
+# events in the header's type_len, large ones with their length after it
+def rawEvent(delta, data, large=False):
+  if large:
+    return struct.pack('<II', delta << 5, len(data) + 4) + data
+  return struct.pack('<I', (delta << 5) | (len(data) // 4)) + data
+
+# Returns a time extend record, adding delta ns to the page's time
+def rawTimeExtend(delta):
+  return struct.pack('<II', ((delta & ((1 << 27) - 1)) << 5) | 30, delta >> 27)
+
+# Returns a 4096 byte ring buffer page starting at timestamp, holding records
+def rawPage(timestamp, records):
+  data = b"".join(records)
+  return (struct.pack('<QQ', timestamp, len(data)) + data).ljust(4096, b'\0')
+
+# Pages of two cpus, with a time extend, another event type, a large event and
+# a flow continuing on a second page, decode into per flow rows merged by time
+def test_parseFtraceFlows_raw_pages(tmp_path):
+  raw_dir = tmp_path / "ftrace_raw"
+  raw_dir.mkdir()
+  (raw_dir / "header_page").write_text(RAW_HEADER_PAGE)
+  (raw_dir / "tcp_probe_format").write_text(RAW_TCP_PROBE_FORMAT)
+
+  start = 1000 * 10 ** 9
+  first = ("10.0.0.1", 5201, "10.0.0.2", 5001)
+  second = ("10.0.0.3", 5202, "10.0.0.4", 5002)
+  # over 2^27 ns, so it needs a time extend
+  gap = 3 * 10 ** 9
+  (raw_dir / "cpu0.raw").write_bytes(
+    rawPage(start, [
+      rawEvent(0, rawProbe(*first, 10)),
+      rawEvent(1000, rawProbe(*first, 99, event_id=99)),
+      rawTimeExtend(gap),
+      rawEvent(500, rawProbe(*first, 30))
+    ]) +
+    rawPage(start + 4 * 10 ** 9, [
+      rawEvent(0, rawProbe(*first, 20)),
+      rawEvent(2000, rawProbe(*second, 7), large=True)
+    ])
+  )
+  (raw_dir / "cpu1.raw").write_bytes(
+    rawPage(start + 2 * 10 ** 9, [
+      rawEvent(0, rawProbe(*first, 15)),
+      rawEvent(7000, rawProbe(*second, 5))
+    ])
+  )
+
+  flows = parseFtraceFlows(str(raw_dir), 1000.0)
+  assert set(flows) == {("10.0.0.1:5201", "10.0.0.2:5001"), ("10.0.0.3:5202", "10.0.0.4:5002")}
+
+  ftrace = getFtraceFlow(flows, "10.0.0.1", "5201", "10.0.0.2", "5001")
+  assert np.allclose(ftrace['Time'], [0.0, 2.0, 3.0000015, 4.0])
+  assert ftrace['CWND'].tolist() == [10, 15, 30, 20]
+
+  ftrace = getFtraceFlow(flows, "10.0.0.3", "5202", "10.0.0.4", "5002")
+  assert np.allclose(ftrace['Time'], [2.000007, 4.000002])
+  assert ftrace['CWND'].tolist() == [5, 7]
+
+# Returns a pcap record of an Ethernet framed IPv4 TCP segment sent at time,
+# sequence numbers wrapping at 2^32
+def pcapSegment(time, src, sport, dest, dport, seq, ack, flags, payload):
+  tcp = struct.pack('!HHIIBBHHH', sport, dport, seq % 2 ** 32, ack % 2 ** 32, 5 << 4, flags, 65535, 0, 0) + b'\0' * payload
+  ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp), 0, 0, 64, 6, 0, socket.inet_aton(src), socket.inet_aton(dest))
+  frame = b'\0' * 12 + struct.pack('!H', 0x0800) + ip + tcp
+  return struct.pack('<IIII', int(time), round(time % 1 * 1e6), len(frame), len(frame)) + frame
+
+# A flow whose sequence numbers wrap, with a retransmit, has its goodput,
+# retransmits and RTT samples binned per interval, the ACK of the resent
+# segment not being an RTT sample
+def test_parsePcapFlows_synthetic(tmp_path):
+  sender = ("10.0.0.1", 5201, "10.0.0.2", 5001)
+  receiver = ("10.0.0.2", 5001, "10.0.0.1", 5201)
+  seq = 2 ** 32 - 1000
+  segments = [
+    (0.00, *sender, seq, 1, 0x10, 1000),
+    (0.01, *sender, seq + 1000, 1, 0x10, 1000),
+    (0.02, *receiver, 1, seq, 0x10, 0),
+    (0.03, *receiver, 1, seq + 1000, 0x10, 0),
+    (0.05, *receiver, 1, seq + 2000, 0x10, 0),
+    (0.11, *sender, seq + 2000, 1, 0x10, 1000),
+    (0.12, *sender, seq + 2000, 1, 0x10, 1000),
+    (0.16, *receiver, 1, seq + 3000, 0x10, 0)
+  ]
+  path = tmp_path / "capture.pcap"
+  path.write_bytes(
+    struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1) + b"".join(pcapSegment(1000 + t, *rest) for t, *rest in segments)
+  )
+
+  flows = parsePcapFlows([str(path)], 1000.0, interval=0.1)
+  assert list(flows) == [("10.0.0.1:5201", "10.0.0.2:5001")]
+
+  pcap = getPcapFlow(flows, "10.0.0.1", "5201", "10.0.0.2", "5001")
+  assert np.allclose(pcap['Time'], [0.0, 0.1])
+  assert np.allclose(pcap['Goodput'], [2000 * 8 / 0.1 / 1e6, 1000 * 8 / 0.1 / 1e6])
+  assert pcap['Retransmits'].tolist() == [0, 1]
+  assert np.allclose(pcap['RTT'], [35.0, np.nan], equal_nan=True)
+  assert np.allclose(pcap['MinRTT'], [30.0, np.nan], equal_nan=True)